@@ -1,3 +1,4 @@
 from .core import *
 from .langmods import c
 from .langmods import python
+from . import ninja
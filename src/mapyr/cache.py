@@ -0,0 +1,359 @@
+'''
+    Artifact cache: outputs of rules commands stored by hash of command and its inputs,
+    shared between checkouts and machines. See `ToolConfig.ARTIFACT_CACHE`
+'''
+
+import os
+import re
+import io
+import sys
+import json
+import tarfile
+import hashlib
+import threading
+import argparse
+import urllib.request
+import urllib.error
+import http.server
+
+import mapyr.utils as utils
+from mapyr.logs import logger
+
+ROOT_MARK = '@MAPYR_ROOT@'
+'''
+    Placeholder of build root directory in keys and depfiles
+'''
+
+PACKAGE_MARK = '@MAPYR_PACKAGE@'
+'''
+    Placeholder of mapyr package directory in keys (scripts of mapyr in commands, e.g. python worker)
+'''
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MANIFEST_SIZE = 16
+'''
+    Max number of input variants (results) in manifest of one command
+'''
+
+_KEY_RE = re.compile(r'^[mr]-[0-9a-f]{64}$')
+
+#----------------------BACKENDS------------------------
+
+class LocalBackend:
+    '''
+        Cache in local directory
+    '''
+
+    def __init__(self, path:str):
+        self.path = os.path.abspath(os.path.expanduser(path))
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.path, key[2:4], key)
+
+    def get(self, key:str) -> bytes:
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key:str, data:bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+class HttpBackend:
+    '''
+        Cache on HTTP server: GET and PUT of `<url>/<key>`, see `serve`
+    '''
+
+    def __init__(self, url:str, timeout:float = 10):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def get(self, key:str) -> bytes:
+        try:
+            with urllib.request.urlopen(f'{self.url}/{key}', timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def put(self, key:str, data:bytes) -> None:
+        request = urllib.request.Request(f'{self.url}/{key}', data=data, method='PUT')
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+def get_backend(spec:str) -> LocalBackend|HttpBackend:
+    '''
+        Backend by URL (http:// or https://) or directory path
+    '''
+    if spec.startswith('http://') or spec.startswith('https://'):
+        return HttpBackend(spec)
+    return LocalBackend(spec)
+
+#----------------------END BACKENDS--------------------
+
+#----------------------RULES CACHE---------------------
+
+_hashes : dict[str,tuple[int,int,str]] = {}
+'''
+    Content hashes of files: path -> (modification time, size, hash)
+'''
+
+_hashes_lock = threading.Lock()
+
+def file_hash(path:str) -> str:
+    '''
+        Hash of file content, cached until file modification
+    '''
+    stat = os.stat(path)
+    with _hashes_lock:
+        cached = _hashes.get(path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+
+    with _hashes_lock:
+        _hashes[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+def _digest(data) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+class ArtifactCache:
+    '''
+        Outputs of rules commands in cache backend.
+
+        Command key: identity, arguments and hashes of declared inputs (prerequisites of rule
+        and prerequisites of not buildable ones: source -> headers). Manifest of command keeps variants
+        of inputs discovered by command (depfile) and results for them, result is archive of outputs.
+        Paths inside build root and mapyr package are stored relative to them, so checkouts in different directories share results
+    '''
+
+    def __init__(self, backend, root:str):
+        self.backend = backend
+        self.root = root
+        self.keys = {}
+        self.lock = threading.Lock()
+
+        self.restored = 0
+        '''
+            Number of restored commands
+        '''
+
+        self.disabled = False
+        '''
+            Cache is not used after backend error
+        '''
+
+    def _disable(self, error:Exception) -> None:
+        with self.lock:
+            if self.disabled:
+                return
+            self.disabled = True
+        logger.warning(f'Artifact cache disabled: {error}')
+
+    def _normalize(self, value:str) -> str:
+        return value.replace(PACKAGE_DIR, PACKAGE_MARK).replace(self.root, ROOT_MARK)
+
+    def _denormalize(self, value:str) -> str:
+        return value.replace(ROOT_MARK, self.root).replace(PACKAGE_MARK, PACKAGE_DIR)
+
+    def _inputs(self, rule) -> dict[str,str]:
+        result = {}
+        stack = list(rule.prerequisites or [])
+        visited = set()
+        while stack:
+            prq = stack.pop()
+            if prq.phony or prq.target in visited:
+                continue
+            visited.add(prq.target)
+            result[self._normalize(prq.target)] = file_hash(prq.target)
+            if not prq.exec and prq.prerequisites:
+                stack.extend(prq.prerequisites)
+        return result
+
+    def _outputs(self, compile_command) -> list[str]:
+        return [compile_command.output] + ([compile_command._depfile] if compile_command._depfile else []) + compile_command._extra_outputs
+
+    def is_cacheable(self, rule, compile_command) -> bool:
+        return not self.disabled and not rule.phony and compile_command._cacheable and bool(compile_command.output) \
+            and bool(compile_command.arguments or compile_command.command)
+
+    def restore(self, rule, compile_command, temp_output:str = None) -> bool:
+        '''
+            Restore outputs of command, main output is written to temp_output if given.
+            Returns True if outputs restored
+        '''
+        if not self.is_cacheable(rule, compile_command):
+            return False
+
+        try:
+            arguments = compile_command.arguments or compile_command.command
+            key = _digest([
+                compile_command._identity,
+                self._normalize(compile_command.directory or ''),
+                [self._normalize(x) for x in arguments] if type(arguments) is list else self._normalize(arguments),
+                self._inputs(rule),
+            ])
+            with self.lock:
+                self.keys[rule.target] = key
+
+            data = self.backend.get(f'm-{key}')
+            if data is None:
+                return False
+
+            for variant in json.loads(data):
+                if all(self._hash_or_none(path) == digest for path, digest in variant['inputs'].items()):
+                    archive = self.backend.get(f'r-{variant["result"]}')
+                    if archive is not None:
+                        self._unpack(archive, compile_command, temp_output)
+                        with self.lock:
+                            self.keys.pop(rule.target, None)
+                            self.restored += 1
+                        logger.debug(f'Restored from cache: {rule.target}')
+                        return True
+        except Exception as e:
+            self._disable(e)
+        return False
+
+    def store(self, rule, compile_command) -> None:
+        '''
+            Store outputs of successfully executed command
+        '''
+        if not self.is_cacheable(rule, compile_command):
+            return
+        with self.lock:
+            key = self.keys.pop(rule.target, None)
+        if key is None:
+            return
+
+        try:
+            discovered = {}
+            if compile_command._depfile and os.path.isfile(compile_command._depfile):
+                for _, prerequisites in utils.parse_d_file(compile_command._depfile):
+                    for path in prerequisites:
+                        path = path if os.path.isabs(path) else os.path.join(compile_command.directory or '', path)
+                        if os.path.isfile(path):
+                            discovered[self._normalize(path)] = file_hash(path)
+
+            result = _digest([key, discovered])
+            self.backend.put(f'r-{result}', self._pack(compile_command))
+
+            data = self.backend.get(f'm-{key}')
+            manifest = json.loads(data) if data else []
+            manifest = [x for x in manifest if x['result'] != result][-(MANIFEST_SIZE - 1):]
+            manifest.append({'inputs': discovered, 'result': result})
+            self.backend.put(f'm-{key}', json.dumps(manifest).encode('utf-8'))
+        except Exception as e:
+            self._disable(e)
+
+    def _hash_or_none(self, path:str) -> str:
+        path = self._denormalize(path)
+        return file_hash(path) if os.path.isfile(path) else None
+
+    def _pack(self, compile_command) -> bytes:
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+            for path in self._outputs(compile_command):
+                with open(path, 'rb') as f:
+                    content = f.read()
+                if path == compile_command._depfile:
+                    content = content.replace(self.root.encode('utf-8'), ROOT_MARK.encode('utf-8'))
+                info = tarfile.TarInfo(self._normalize(path))
+                info.size = len(content)
+                info.mode = os.stat(path).st_mode & 0o777
+                tar.addfile(info, io.BytesIO(content))
+        return buffer.getvalue()
+
+    def _unpack(self, archive:bytes, compile_command, temp_output:str) -> None:
+        outputs = self._outputs(compile_command)
+        with tarfile.open(fileobj=io.BytesIO(archive), mode='r:gz') as tar:
+            members = {x.name: x for x in tar.getmembers()}
+            for path in outputs:
+                info = members[self._normalize(path)]
+                content = tar.extractfile(info).read()
+                if path == compile_command._depfile:
+                    content = content.replace(ROOT_MARK.encode('utf-8'), self.root.encode('utf-8'))
+
+                destination = temp_output if temp_output and path == compile_command.output else path
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                temp_path = f'{destination}.{os.getpid()}.{threading.get_ident()}.tmp'
+                with open(temp_path, 'wb') as f:
+                    f.write(content)
+                os.chmod(temp_path, info.mode)
+                os.replace(temp_path, destination)
+
+#----------------------END RULES CACHE-----------------
+
+#----------------------SERVER--------------------------
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    backend : LocalBackend = None
+
+    def _key(self) -> str:
+        key = self.path.strip('/')
+        if not _KEY_RE.match(key):
+            self.send_error(400, 'Wrong key')
+            return None
+        return key
+
+    def do_GET(self):
+        key = self._key()
+        if key is None:
+            return
+        data = self.backend.get(key)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        key = self._key()
+        if key is None:
+            return
+        self.backend.put(key, self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def serve(path:str, host:str = '127.0.0.1', port:int = 8080) -> http.server.ThreadingHTTPServer:
+    '''
+        Make reference cache server storing data in directory, start it by `serve_forever()`
+    '''
+    handler = type('Handler', (_Handler,), {'backend': LocalBackend(path)})
+    return http.server.ThreadingHTTPServer((host, port), handler)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Mapyr artifact cache')
+    parser.add_argument('command', choices=['serve'])
+    parser.add_argument('--dir', default=os.path.join(os.path.expanduser('~'), '.cache', 'mapyr', 'artifacts'), help='Storage directory')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    server = serve(args.dir, args.host, args.port)
+    print(f'Serving {args.dir} on http://{args.host}:{server.server_port}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+#----------------------END SERVER----------------------
@@ -1,14 +1,38 @@
 import sys
 import os
 import concurrent.futures
+import collections
+import collections.abc
+import array
+import argparse
 import traceback
 import copy
 import threading
 import json
+import functools
+import itertools
+import contextlib
+import contextvars
+import asyncio
+import inspect
+import shlex
+import signal
+import cProfile
+import pstats
+import shutil
+import subprocess
+import time
+import uuid
 import mapyr.utils as utils
 from mapyr.exceptions import Exceptions
 from mapyr.logs import logger,console_handler
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
 VERSION = '0.9.1'
 
 #----------------------CONFIG--------------------------
@@ -34,13 +58,123 @@ class ToolConfig:
             Verbosity level for console output. Value can be any from logging module: ['CRITICAL','FATAL','ERROR','WARN','WARNING','INFO','DEBUG','NOTSET']
         '''
 
+        self.POOLS : dict[str,int] = {'link': 2}
+        '''
+            Resource pools: name -> max number of rules from the pool running at the same time.
+            Rule is assigned to pool by `Rule.pool`. Pools not listed here are not limited
+        '''
+
+        self.KEEP_GOING : bool = False
+        '''
+            Don't stop on error, build everything that not depends on failed rules
+            and report all failures at the end
+        '''
+
+        self.FAIL_FAST : bool = False
+        '''
+            On error terminate already running child processes immediately
+            instead of waiting for them. Ignored if KEEP_GOING is set
+        '''
+
+        self.EXPLAIN : bool = False
+        '''
+            Log reason of every executed rule and summary of root causes
+        '''
+
+        self.CACHE_PATH : str = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'mapyr')
+        '''
+            User wide cache directory (results of toolchain probing etc.)
+        '''
+
+        self.DATA_PATH : str = '.mapyr'
+        '''
+            Directory for mapyr data (build history etc.), relative to project directory
+        '''
+
+        self.SHARD : str = None
+        '''
+            Build only part of object level rules: 'i/N' - i-th of N parts (1 <= i <= N),
+            or 'merge' - build the rest, objects have to be already built by all shards.
+            Partitioning uses rules build time history if it present, otherwise sizes of sources.
+            All shards must have the same history to get the same partitioning
+        '''
+
+        self.ARTIFACT_CACHE : str = None
+        '''
+            Artifact cache of rules outputs: directory path or http(s):// URL of cache server
+            (`python -m mapyr.cache serve`). Key of outputs is command and hashes of its inputs
+        '''
+
+        self.PROFILE : str = None
+        '''
+            Profile python code of configuration phase (`get_project` functions)
+            and `exec` functions of rules: 'cprofile' - deterministic profiler, `.pstats` files
+            (only thread of the phase is profiled; since Python 3.12 cProfile is process wide,
+            so profiled `exec` functions run one at a time), 'sample' - sampling profiler,
+            collapsed stacks `.folded` files (flamegraph.pl, speedscope...). Results go to `PROFILE_PATH`
+        '''
+
+        self.PROFILE_PATH : str = os.path.join('.mapyr', 'profile')
+        '''
+            Directory of profiling results, relative to current directory
+        '''
+
 CONFIG : ToolConfig = ToolConfig()
 
 #----------------------END CONFIG----------------------
 
 #----------------------RULE----------------------------
 
+_POSIX = os.name != 'nt'
+
+class RuleList(collections.abc.MutableSequence):
+    '''
+        Prerequisites of rule without stored list. List is created in owner rule on first insert,
+        so rules without prerequisites (sources, headers) don't keep empty lists
+    '''
+
+    __slots__ = ('_owner',)
+
+    def __init__(self, owner:'Rule') -> None:
+        self._owner = owner
+
+    def _list(self) -> list['Rule']:
+        if self._owner._prerequisites is None:
+            self._owner._prerequisites = []
+        return self._owner._prerequisites
+
+    def __len__(self) -> int:
+        return len(self._owner._prerequisites or ())
+
+    def __getitem__(self, index):
+        return (self._owner._prerequisites or [])[index]
+
+    def __setitem__(self, index, value):
+        self._list()[index] = value
+
+    def __delitem__(self, index):
+        del self._list()[index]
+
+    def __iter__(self):
+        return iter(self._owner._prerequisites or ())
+
+    def insert(self, index, value):
+        self._list().insert(index, value)
+
+    def append(self, value):
+        self._list().append(value)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, collections.abc.Sequence):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
 class Rule:
+    __slots__ = ('_dir','_name','_prerequisites','exec','phony','parent','pool')
+
     def __init__(
             self,
             target              : str,
@@ -48,44 +182,226 @@ class Rule:
             prerequisites       : list['Rule']      = None,
             exec                : 'function'        = None,
             phony               : bool              = False,
+            pool                : str               = None,
         ) -> None:
 
-        self.target : str = target
+        # Construction of large graphs is hot path: slots are set directly,
+        # on POSIX absolute path is checked by prefix instead of `os.path.isabs`
+        if not phony and not (target.startswith('/') if _POSIX else os.path.isabs(target)):
+            target = f'{parent.private_config.CWD}/{target}'
+
+        head, sep, self._name = target.rpartition('/')
+        self._dir = sys.intern(head) if sep else None
+        self._prerequisites = prerequisites or None
+
+        self.exec = exec
+        self.phony = phony
+        self.parent = parent
+        self.pool = pool
+
+    @property
+    def target(self) -> str:
         '''
-            Output file or phony name
+            Output file or phony name.
+            Stored as interned directory and name, so all rules of one directory share directory string
         '''
+        if self._dir is None:
+            return self._name
+        return f'{self._dir}/{self._name}'
+
+    @target.setter
+    def target(self, value:str):
+        head, sep, self._name = value.rpartition('/')
+        self._dir = sys.intern(head) if sep else None
 
-        self.prerequisites : list[Rule] = prerequisites if prerequisites else []
+    @property
+    def prerequisites(self) -> list['Rule']:
         '''
             All rules that have to be done before this rule
         '''
+        prerequisites = self._prerequisites
+        return prerequisites if prerequisites is not None else RuleList(self)
 
-        self.exec : function = exec
+    @prerequisites.setter
+    def prerequisites(self, value:list['Rule']):
+        self._prerequisites = (value if type(value) is list else list(value)) if value else None
+
+    # Documentation of slots
+    exec : 'function'
+    '''
+        Execution function: def my_exec_func(rule:Rule) -> CompileCommand | None
+    '''
+
+    phony : bool
+    '''
+        Phony target not expects output file, and will be executed every time when called
+    '''
+
+    parent : 'ProjectBase'
+    '''
+        Parent project
+    '''
+
+    pool : str
+    '''
+        Resource pool name, limits how many rules of the pool run at the same time. See `ToolConfig.POOLS`
+    '''
+
+    def __deepcopy__(self, memo) -> 'Rule':
+        rule = Rule.__new__(Rule)
+        memo[id(self)] = rule
+        rule._dir = self._dir
+        rule._name = self._name
+        rule.exec = self.exec
+        rule.phony = self.phony
+        rule.pool = self.pool
+        rule.parent = copy.deepcopy(self.parent, memo)
+        rule._prerequisites = [copy.deepcopy(x, memo) for x in self._prerequisites] if self._prerequisites else None
+        return rule
+
+    def __str__(self) -> str:
+        return f'{self.target}:{self.prerequisites}'
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+#----------------------END RULE------------------------
+
+#----------------------GRAPH INDEX---------------------
+
+class GraphIndex:
+    '''
+        Forward and reverse adjacency index over rules of projects.
+        Rules with the same target are one node
+    '''
+
+    def __init__(self, projects:list['ProjectBase']) -> None:
+        self.rules : list[Rule] = []
         '''
-            Execution function: def my_exec_func(rule:Rule) -> CompileCommand | None
+            Node index -> rule (first met rule of the target)
         '''
 
-        self.phony : bool = phony
+        self.ids : dict = {}
         '''
-            Phony target not expects output file, and will be executed every time when called
+            Rule key -> node index
         '''
 
-        self.parent : ProjectBase = parent
+        self.forward : list[array.array] = []
         '''
-            Parent project
+            Node index -> prerequisites indexes
         '''
 
-        if not self.phony:
-            if not os.path.isabs(self.target):
-                self.target = f'{self.parent.private_config.CWD}/{self.target}'
+        self.reverse : list[array.array] = []
+        '''
+            Node index -> dependents indexes
+        '''
 
-    def __str__(self) -> str:
-        return f'{self.target}:{self.prerequisites}'
+        self.cwd : str = projects[0].private_config.CWD if projects else os.getcwd()
 
-    def __repr__(self) -> str:
-        return self.__str__()
+        # Rule object -> node index
+        node_of = {}
+        stack = [x for p in projects for x in p.rules + ([p.main_rule] if p.main_rule else [])]
+        while stack:
+            rule = stack.pop()
+            if rule in node_of:
+                continue
+            i = node_of[rule] = self.ids.setdefault(_rule_key(rule), len(self.rules))
+            if i == len(self.rules):
+                self.rules.append(rule)
+            if rule._prerequisites:
+                stack.extend(rule._prerequisites)
+
+        forward = [[] for _ in self.rules]
+        reverse = [[] for _ in self.rules]
+        for rule, i in node_of.items():
+            prerequisites = rule._prerequisites
+            if prerequisites:
+                for prq in prerequisites:
+                    j = node_of[prq]
+                    forward[i].append(j)
+                    reverse[j].append(i)
+
+        self.forward = [array.array('I', dict.fromkeys(x)) for x in forward]
+        self.reverse = [array.array('I', dict.fromkeys(x)) for x in reverse]
+
+    def find(self, target:str) -> list[Rule]:
+        '''
+            Find nodes by target path (absolute, relative to current or project directory, or its ending) or phony name
+        '''
+        for path in [target, os.path.abspath(target), os.path.join(self.cwd, target)]:
+            if path in self.ids:
+                return [self.rules[self.ids[path]]]
 
-#----------------------END RULE------------------------
+        result = [x for x in self.rules if x.target == target or x.target.endswith(f'/{target}')]
+        if not result:
+            raise Exceptions.RuleNotFound(target)
+        return result
+
+    def _walk(self, rules:list[Rule], adjacency:list[array.array]) -> list[Rule]:
+        visited = set()
+        queue = collections.deque(self.ids[_rule_key(x)] for x in rules)
+        while queue:
+            i = queue.popleft()
+            for j in adjacency[i]:
+                if j not in visited:
+                    visited.add(j)
+                    queue.append(j)
+        return [self.rules[x] for x in sorted(visited)]
+
+    def deps(self, target:str, recursive:bool = True) -> list[Rule]:
+        '''
+            Prerequisites of target
+        '''
+        rules = self.find(target)
+        if not recursive:
+            return [self.rules[j] for x in rules for j in self.forward[self.ids[_rule_key(x)]]]
+        return self._walk(rules, self.forward)
+
+    def rdeps(self, target:str, recursive:bool = True) -> list[Rule]:
+        '''
+            Rules that depend on target
+        '''
+        rules = self.find(target)
+        if not recursive:
+            return [self.rules[j] for x in rules for j in self.reverse[self.ids[_rule_key(x)]]]
+        return self._walk(rules, self.reverse)
+
+    def affected(self, files:list[str]) -> list[Rule]:
+        '''
+            Buildable targets (objects, binaries...) that will be rebuilt if files changed.
+            Files not in graph (docs, CI configs of change list) are skipped
+        '''
+        rules = []
+        for f in files:
+            try:
+                rules.extend(self.find(f))
+            except Exceptions.RuleNotFound:
+                logger.debug(f'Not in graph: {f}')
+        return [x for x in self._walk(rules, self.reverse) if x.exec and not x.phony]
+
+    def paths(self, start:str, end:str, limit:int = 100) -> list[list[Rule]]:
+        '''
+            Dependency chains from `start` target down to its prerequisite `end`, not more than `limit`
+        '''
+        ends = set(self.ids[_rule_key(x)] for x in self.find(end))
+
+        # Only nodes from which `end` is reachable
+        useful = set(self.ids[_rule_key(x)] for x in self._walk([self.rules[x] for x in ends], self.reverse)) | ends
+
+        result = []
+        for rule in self.find(start):
+            stack = [[self.ids[_rule_key(rule)]]]
+            while stack and len(result) < limit:
+                path = stack.pop()
+                if path[-1] in ends:
+                    result.append([self.rules[x] for x in path])
+                    continue
+                for j in reversed(self.forward[path[-1]]):
+                    if j in useful and j not in path:
+                        stack.append(path + [j])
+        return result
+
+#----------------------END GRAPH INDEX-----------------
 
 class ConfigBase:
     '''
@@ -172,6 +488,39 @@ class CompileCommand:
 
         self._name : str = 'Unnamed'
 
+        self._atomic : bool = True
+        '''
+            Output is written into temporary path from arguments
+            and renamed to output after success, so broken output never appears.
+            Must be False if command updates existing output
+        '''
+
+        self._post_exec = None
+        '''
+            Function without arguments called after successful execution
+        '''
+
+        self._depfile : str = None
+        '''
+            File where command writes its inputs in make format (e.g. compiler '-MF').
+            It is output of command too
+        '''
+
+        self._extra_outputs : list[str] = []
+        '''
+            Other files produced by command besides output and depfile
+        '''
+
+        self._identity : str = None
+        '''
+            What defines result besides arguments and inputs, e.g. tool version. Part of artifact cache key
+        '''
+
+        self._cacheable : bool = True
+        '''
+            Outputs of command can be stored in artifact cache. Must be False if command updates existing output
+        '''
+
 
     def get_dict(self):
         filtered = {k: v for k, v in self.__dict__.items() if v is not None and not k.startswith('_')}
@@ -180,6 +529,739 @@ class CompileCommand:
     def __str__(self) -> str:
         return json.dumps(self.get_dict())
 
+    def get_temp_output(self) -> str:
+        '''
+            Temporary output path or None if command can not be redirected
+        '''
+        if not self._atomic or not self.output or not self.arguments or self.output not in self.arguments:
+            return None
+        return temp_output_path(self.output)
+
+def temp_output_path(path:str) -> str:
+    '''
+        Path of output while it is being produced. Extension is kept, tools may rely on it
+    '''
+    root, ext = os.path.splitext(path)
+    return f'{root}.mapyr-tmp{ext}'
+
+def stamp_path(path:str) -> str:
+    '''
+        Stamp of last execution of rule which leaves target untouched if result is the same
+        (like `restat` of ninja). Rule is up to date while stamp is newer than prerequisites,
+        dependents still check only target
+    '''
+    return f'{path}.stamp'
+
+def _lock_file(file, blocking:bool = True) -> None:
+    '''
+        Exclusive lock of file until it is closed, OSError if not blocking and file is locked by other process
+    '''
+    if fcntl:
+        fcntl.flock(file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+
+class BuildJournal:
+    '''
+        Journal of rules in progress of one build session: '+target' when started, '-target' when finished.
+        Every session has own journal file in journals directory, locked while the session runs.
+        Outputs of rules that were not finished by dead sessions (crash, kill, power off)
+        may be broken, they are removed before next build
+    '''
+
+    def __init__(self, directory:str):
+        self.directory = directory
+        self.path : str = None
+        self.file = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _unfinished(file) -> list[str]:
+        in_progress = {}
+        for line in file:
+            line = line.rstrip('\n')
+            if line.startswith('+'):
+                in_progress[line[1:]] = None
+            elif line.startswith('-'):
+                in_progress.pop(line[1:], None)
+        return list(in_progress)
+
+    @staticmethod
+    def _remove_outputs(targets:list[str]) -> None:
+        for target in targets:
+            utils.silentremove(target)
+            utils.silentremove(temp_output_path(target))
+
+    def recover(self) -> list[str]:
+        '''
+            Remove outputs of unfinished rules of dead sessions (journals not locked by running sessions),
+            return their paths
+        '''
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            return []
+
+        result = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            # Journal being created or own one
+            if name.startswith('.') or path == self.path:
+                continue
+            try:
+                file = open(path, 'r')
+            except OSError:
+                continue
+            with file:
+                try:
+                    _lock_file(file, False)
+                except OSError:
+                    continue
+                targets = self._unfinished(file)
+                self._remove_outputs(targets)
+                if fcntl:
+                    # Removed while locked, so no other session recovers it again
+                    utils.silentremove(path)
+            if not fcntl:
+                # Windows doesn't remove open files: journal may be just created by other session
+                try:
+                    utils.silentremove(path)
+                except OSError:
+                    pass
+            result.extend(targets)
+        return result
+
+    def open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+
+        name = f'{os.getpid()}-{uuid.uuid4().hex}'
+        self.path = os.path.join(self.directory, name)
+        if fcntl:
+            # Journal appears under its name only when it is locked
+            temp_path = os.path.join(self.directory, f'.{name}')
+            self.file = open(temp_path, 'a+')
+            _lock_file(self.file)
+            os.replace(temp_path, self.path)
+        else:
+            # Windows doesn't rename open files
+            self.file = open(self.path, 'a+')
+            _lock_file(self.file)
+
+    def _write(self, line:str) -> None:
+        with self.lock:
+            self.file.write(f'{line}\n')
+            self.file.flush()
+
+    def start(self, target:str) -> None:
+        self._write(f'+{target}')
+
+    def finish(self, target:str) -> None:
+        self._write(f'-{target}')
+
+    def close(self) -> None:
+        '''
+            Close journal and remove it. Outputs of rules of the session that were not finished are removed
+        '''
+        if self.file is None:
+            return
+        # Read by own handle, Windows locks are per handle
+        self.file.seek(0)
+        self._remove_outputs(self._unfinished(self.file))
+        if fcntl:
+            utils.silentremove(self.path)
+            self.file.close()
+        else:
+            self.file.close()
+            utils.silentremove(self.path)
+        self.file = None
+
+#----------------------TOOLS PROBING-------------------
+
+_probes : dict[str,list] = None
+_probes_lock = threading.Lock()
+
+def _mtime_ns(path:str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def probe_tool(cmd:list[str], env:list[str] = None, input:str = '', files:list[str] = None) -> tuple[int,str,str]:
+    '''
+        Run tool and get (return code, stdout, stderr).
+        Successful result is cached in `ToolConfig.CACHE_PATH`, key is tool binary path and modification time,
+        arguments, input, values of environment variables listed in `env` and modification times
+        of `files` (data of tool: files or directories, may not exist).
+        Failed runs are not cached, tool may succeed after environment fix
+    '''
+    global _probes
+
+    path = shutil.which(cmd[0])
+    if not path:
+        return (127, '', f'{cmd[0]}: not found')
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+
+    key = json.dumps([path, stat.st_mtime_ns, stat.st_size, cmd[1:], input, {x:os.environ.get(x) for x in env or []},
+        {x:_mtime_ns(x) for x in files or []}])
+    cache_path = os.path.join(CONFIG.CACHE_PATH, 'toolchain.json')
+
+    with _probes_lock:
+        if _probes is None:
+            _probes = utils.load_json(cache_path, {})
+        if key in _probes:
+            return tuple(_probes[key])
+
+    logger.debug(f'Probing: {cmd}')
+    out = subprocess.run([cmd[0]] + cmd[1:], input=input, capture_output=True, text=True)
+    result = (out.returncode, out.stdout, out.stderr)
+    if out.returncode != 0:
+        return result
+
+    with _probes_lock:
+        _probes[key] = result
+        try:
+            utils.save_json(cache_path, _probes)
+        except OSError as e:
+            logger.debug(f'Toolchain cache not saved: {e}')
+    return result
+
+#----------------------END TOOLS PROBING---------------
+
+#----------------------PROFILING-----------------------
+
+class Profiler:
+    '''
+        Profiling of build phases. Results of phases with the same name are accumulated
+    '''
+
+    SAMPLE_INTERVAL = 0.005
+    '''
+        Seconds between samples of sampling profiler
+    '''
+
+    CPROFILE_PROCESS_WIDE : bool = sys.version_info >= (3, 12)
+    '''
+        cProfile uses `sys.monitoring`: only one profiler can be enabled in process and it records all threads
+    '''
+
+    def __init__(self, kind:str, path:str):
+        if kind not in ('cprofile', 'sample'):
+            raise ValueError(f'Unknown profiler: {kind}')
+        self.kind = kind
+        self.path = path
+        self.lock = threading.Lock()
+
+        # cprofile: phase name -> pstats.Stats
+        self.stats = {}
+
+        # cprofile: number of enabled profilers, and condition of their disabling
+        self.profilers = 0
+        self.profiler_free = threading.Condition(self.lock)
+
+        # sample: phase name -> collapsed stack -> samples number
+        self.stacks : dict[str,collections.Counter] = {}
+        self.threads : dict[int,str] = {}
+        self.all_threads_phase : str = None
+        self.sampler : threading.Thread = None
+
+    @contextlib.contextmanager
+    def phase(self, name:str, all_threads:bool = False):
+        '''
+            Profile code in the context as phase `name`.
+            all_threads : sampling profiler takes samples of all threads, not only current one
+
+            cProfile: phase inside of other profiled phase of the same thread is part of it.
+            If cProfile is process wide (see `CPROFILE_PROCESS_WIDE`), phases are run one at a time,
+            phases of threads started inside of profiled phase (`load_projects`) are part of it
+        '''
+        if self.kind == 'cprofile':
+            enclosing = _profiled_thread.get()
+            if enclosing is not None and (self.CPROFILE_PROCESS_WIDE or enclosing == threading.get_ident()):
+                yield
+                return
+
+            with self.profiler_free:
+                while self.CPROFILE_PROCESS_WIDE and self.profilers:
+                    self.profiler_free.wait()
+                self.profilers += 1
+
+            token = _profiled_thread.set(threading.get_ident())
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                try:
+                    yield
+                finally:
+                    profile.disable()
+            finally:
+                _profiled_thread.reset(token)
+                with self.profiler_free:
+                    self.profilers -= 1
+                    self.profiler_free.notify_all()
+                    if name in self.stats:
+                        self.stats[name].add(profile)
+                    else:
+                        self.stats[name] = pstats.Stats(profile)
+            return
+
+        ident = threading.get_ident()
+        with self.lock:
+            if all_threads:
+                self.all_threads_phase = name
+            else:
+                self.threads[ident] = name
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self._sample, daemon=True)
+                self.sampler.start()
+        try:
+            yield
+        finally:
+            with self.lock:
+                if all_threads:
+                    self.all_threads_phase = None
+                else:
+                    self.threads.pop(ident, None)
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.SAMPLE_INTERVAL)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, frame in frames.items():
+                    name = self.threads.get(ident, self.all_threads_phase)
+                    if name is None or ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                        frame = frame.f_back
+                    self.stacks.setdefault(name, collections.Counter())[';'.join(reversed(stack))] += 1
+
+    def save(self) -> None:
+        '''
+            Write results: `<phase>.pstats` or `<phase>.folded` files
+        '''
+        os.makedirs(self.path, exist_ok=True)
+        with self.lock:
+            for name, stats in self.stats.items():
+                stats.dump_stats(os.path.join(self.path, f'{name}.pstats'))
+            for name, stacks in self.stacks.items():
+                with open(os.path.join(self.path, f'{name}.folded'), 'w') as f:
+                    for stack, count in stacks.items():
+                        f.write(f'{stack} {count}\n')
+        if self.stats or self.stacks:
+            logger.info(f'Profile: {os.path.abspath(self.path)}')
+
+_profiler : Profiler = None
+
+_profiled_thread : contextvars.ContextVar = contextvars.ContextVar('mapyr_profiled_thread', default=None)
+'''
+    Thread of cProfile phase running in this context
+'''
+
+def get_profiler() -> Profiler:
+    '''
+        Profiler of `CONFIG.PROFILE` kind or None
+    '''
+    global _profiler
+    if not CONFIG.PROFILE:
+        return None
+    if _profiler is None or _profiler.kind != CONFIG.PROFILE:
+        _profiler = Profiler(CONFIG.PROFILE, CONFIG.PROFILE_PATH)
+    return _profiler
+
+def profile_phase(name:str, all_threads:bool = False):
+    '''
+        Context manager profiling phase `name` if profiling enabled
+    '''
+    profiler = get_profiler()
+    return profiler.phase(name, all_threads) if profiler else contextlib.nullcontext()
+
+def _function_name(fnc) -> str:
+    if isinstance(fnc, functools.partial):
+        fnc = fnc.func
+    return f'{getattr(fnc, "__module__", None) or "unknown"}.{getattr(fnc, "__qualname__", None) or type(fnc).__name__}'
+
+#----------------------END PROFILING-------------------
+
+#----------------------SCHEDULER-----------------------
+
+class Scheduler:
+    '''
+        Order of nodes run for `ProjectBase.recursive_run`: node is ready when all its children are done.
+        Whole tree is collected first, cycles are detected
+    '''
+
+    def __init__(self, start_node, children_container_name:str, node_key = None, stop_criteria = None, keep_going:bool = False):
+        cc = os.cpu_count()
+        self.jobs = cc if CONFIG.MAX_THREADS_NUM > cc else CONFIG.MAX_THREADS_NUM
+        self.stop_criteria = stop_criteria
+        self.keep_going = keep_going
+
+        # Unfinished children count and dependents of every node
+        self.pending = {}
+        self.dependents = {}
+        self.ready = collections.deque()
+
+        self.failed = []
+        self.blocked = set()
+        self.stop = False
+        self.error = None
+
+        # Nodes of resource pool run only if pool is not full
+        self.pools_usage = collections.Counter()
+
+        visiting = set()
+        path = []
+        keys = {}
+
+        def canonical(_node):
+            if node_key is None:
+                return _node
+            return keys.setdefault(node_key(_node), _node)
+
+        def enter(_node):
+            children = dict.fromkeys(canonical(x) for x in getattr(_node, children_container_name) or [])
+            self.pending[_node] = len(children)
+            self.dependents[_node] = []
+            visiting.add(_node)
+            path.append((_node, iter(children)))
+
+        enter(canonical(start_node))
+        while path:
+            node, children = path[-1]
+            child = next(children, None)
+            if child is None:
+                path.pop()
+                visiting.remove(node)
+                if self.pending[node] == 0:
+                    self.ready.append(node)
+                continue
+
+            if child in visiting:
+                raise Exceptions.CircularDetected(child)
+            if child not in self.pending:
+                enter(child)
+            self.dependents[child].append(node)
+
+    def has_ready(self) -> bool:
+        return bool(self.ready) and not self.stop
+
+    def take_ready(self):
+        '''
+            Take node to run or None if there are no ready nodes with free pool
+        '''
+        if self.stop:
+            return None
+        for i, _node in enumerate(self.ready):
+            pool = getattr(_node, 'pool', None)
+            if pool is None or self.pools_usage[pool] < CONFIG.POOLS.get(pool, self.jobs):
+                del self.ready[i]
+                self.pools_usage[pool] += 1
+                return _node
+        return None
+
+    def _block(self, node) -> None:
+        todo = [node]
+        while todo:
+            for parent in self.dependents[todo.pop()]:
+                if parent not in self.blocked:
+                    self.blocked.add(parent)
+                    todo.append(parent)
+
+    def finish(self, node, result) -> None:
+        '''
+            Node is finished, result : function returning node function result or raising its exception
+        '''
+        self.pools_usage[getattr(node, 'pool', None)] -= 1
+        try:
+            success = not (self.stop_criteria and self.stop_criteria(result()))
+        except Exception as e:
+            if self.keep_going:
+                logger.error(f'{e}')
+            elif not self.error:
+                self.error = e
+            success = False
+
+        if not success:
+            self.failed.append(node)
+            self._block(node)
+            self.stop = self.stop or not self.keep_going
+            return
+
+        for parent in self.dependents[node]:
+            self.pending[parent] -= 1
+            if self.pending[parent] == 0 and parent not in self.blocked:
+                self.ready.append(parent)
+
+#----------------------END SCHEDULER-------------------
+
+#----------------------BUILD---------------------------
+
+class BuildEvent:
+    '''
+        Progress event of asyncio build, see `ProjectBase.build_async`
+    '''
+
+    def __init__(self, kind:str, rule:Rule, code:int = None, output:str = None):
+        self.kind : str = kind
+        '''
+            'started' - command of rule started,
+            'finished' - rule executed (code is result),
+            'done' - build finished (rule is built rule, code is result)
+        '''
+
+        self.rule : Rule = rule
+        self.code : int = code
+
+        self.output : str = output
+        '''
+            Output of command of rule, for 'finished' events
+        '''
+
+class BuildSession:
+    '''
+        State of one build: up to date checks and their reasons, journal and build time history.
+        Shared by threaded and asyncio builds
+    '''
+
+    def __init__(self, project:'ProjectBase', frozen:set[str] = None):
+        self.project = project
+
+        self.frozen = frozen
+        '''
+            Targets that must not be built, only checked for existence
+        '''
+
+        self.costs : dict[str,float] = {}
+
+        self.outputs : dict[ProjectBase,dict[str,list[str]]] = {}
+        '''
+            Produced outputs: project -> target -> other outputs of rule
+        '''
+
+        self.reasons = {}
+        '''
+            Executed and touched rules: rule key -> (reason, root cause, is executed)
+        '''
+
+        self.journal = BuildJournal(project.data_path('journals'))
+        self.mutex_hash = threading.Lock()
+
+        self.cache = None
+        if CONFIG.ARTIFACT_CACHE:
+            from . import cache
+            self.cache = cache.ArtifactCache(cache.get_backend(CONFIG.ARTIFACT_CACHE), project.private_config.CWD)
+
+    def start(self) -> None:
+        for target in self.journal.recover():
+            self.project.removed_outputs[target] = 'interrupted build'
+        self.journal.open()
+
+    def explain(self, rule : Rule, reason : str, prq : Rule = None, root : str = None, executed : bool = True) -> None:
+        cwd = self.project.private_config.CWD
+        if root:
+            pass
+        elif prq is None:
+            root = f'{reason}: {_relpath(rule, cwd)}'
+        elif _rule_key(prq) in self.reasons:
+            root = self.reasons[_rule_key(prq)][1]
+        else:
+            root = f'changed: {_relpath(prq, cwd)}'
+
+        if prq is not None:
+            reason = f'{reason}: {_relpath(prq, cwd)}'
+
+        self.reasons[_rule_key(rule)] = (reason, root, executed)
+        if CONFIG.EXPLAIN:
+            logger.info(f'Explain: {_relpath(rule, cwd)}: {reason} (root cause: {root})')
+
+    def need_exec(self, rule : Rule) -> bool:
+        '''
+            Up to date check of rule, True if rule must be executed
+        '''
+        if rule.phony:
+            if rule.exec:
+                self.explain(rule, 'phony')
+            return bool(rule.exec)
+
+        if self.frozen and rule.target in self.frozen:
+            if not os.path.exists(rule.target):
+                raise Exceptions.PrerequisiteNotFound(f': {os.path.relpath(rule.target,rule.parent.private_config.CWD)} must be built by shards')
+            return False
+
+        # Hash source names calculation
+        hash_sum = 0
+        for prq in rule.prerequisites:
+            hash_sum = utils.stable_hash(prq.target)
+        hash_sum + utils.stable_hash(rule.target)
+
+        with self.mutex_hash:
+            rule.parent.source_names_hash += hash_sum
+
+        if not os.path.isabs(rule.target):
+            rule.target = f'{rule.parent.private_config.CWD}/{rule.target}'
+
+        # Target doesn't exists
+        if not os.path.exists(rule.target):
+            root = None
+            removed_outputs = itertools.chain(self.project.removed_outputs.items(), rule.parent.removed_outputs.items())
+            for path, removed_reason in removed_outputs:
+                if rule.target == path or rule.target.startswith(f'{path}/'):
+                    root = f'{removed_reason}: {os.path.relpath(path, self.project.private_config.CWD)}'
+                    break
+            self.explain(rule, 'missing target', root=root)
+            return bool(rule.exec)
+
+        # Prerequisite is newer
+        out_date = os.path.getmtime(rule.target)
+        stamp_date = None
+        for prq in rule.prerequisites:
+            if not os.path.isabs(prq.target):
+                prq.target = f'{prq.parent.private_config.CWD}/{prq.target}'
+
+            if not os.path.exists(prq.target):
+                raise Exceptions.PrerequisiteNotFound(f': {os.path.relpath(prq.target,prq.parent.private_config.CWD)}')
+            src_date = os.path.getmtime(prq.target)
+            if src_date > out_date:
+                if rule.exec:
+                    if stamp_date is None:
+                        stamp = stamp_path(rule.target)
+                        stamp_date = os.path.getmtime(stamp) if os.path.exists(stamp) else 0
+                    if src_date <= stamp_date:
+                        continue
+                    self.explain(rule, 'newer prerequisite', prq)
+                    return True
+                else:
+                    # Not buildable targets cannot be updated naturally
+                    # so update them artificially to avoid endless rebuilds
+                    if _rule_key(rule) not in self.reasons:
+                        self.explain(rule, 'touched by newer prerequisite', prq, executed=False)
+                    os.utime(rule.target)
+
+        return False
+
+    def get_command(self, rule : Rule) -> CompileCommand:
+        '''
+            Call exec of rule. Result can be awaitable for `async def` exec functions
+        '''
+        with profile_phase(f'exec.{_function_name(rule.exec)}'):
+            return rule.exec(rule)
+
+    def start_command(self, rule : Rule, compile_command : CompileCommand) -> tuple[list[str]|str,str]:
+        '''
+            Command is going to run: returns its arguments (or command string) and temporary output path
+        '''
+        if compile_command._name:
+            logger.info(f"{compile_command._name}: {os.path.relpath(compile_command.output)}")
+
+        output = None if rule.phony else compile_command.output
+        temp_output = compile_command.get_temp_output() if output else None
+        if temp_output:
+            arguments = [temp_output if x == output else x for x in compile_command.arguments]
+        else:
+            arguments = compile_command.arguments or compile_command.command
+
+        if output:
+            self.journal.start(output)
+        return arguments, temp_output
+
+    def finish_command(self, rule : Rule, compile_command : CompileCommand, temp_output : str, code : int) -> int:
+        '''
+            Command finished with code: rename temporary output or remove broken output.
+            Returns final code
+        '''
+        output = None if rule.phony else compile_command.output
+        try:
+            if code == 0:
+                if temp_output:
+                    os.replace(temp_output, output)
+                if compile_command._post_exec:
+                    compile_command._post_exec()
+        except BaseException:
+            code = 1
+            raise
+        finally:
+            # Broken or partial output must not look up to date
+            if code != 0 and output:
+                utils.silentremove(temp_output if temp_output else output)
+            if output:
+                self.journal.finish(output)
+        return code
+
+    def restore(self, rule : Rule, compile_command : CompileCommand, temp_output : str) -> bool:
+        '''
+            Get outputs of command from artifact cache instead of running it
+        '''
+        return bool(self.cache) and self.cache.restore(rule, compile_command, temp_output)
+
+    def store(self, rule : Rule, compile_command : CompileCommand, code : int) -> None:
+        '''
+            Put outputs of successfully finished command to artifact cache
+        '''
+        if self.cache and code == 0:
+            self.cache.store(rule, compile_command)
+
+    def rule_done(self, rule : Rule, compile_command : CompileCommand, start : float, code : int) -> None:
+        '''
+            Rule executed: save its time and record produced outputs
+        '''
+        if rule.phony or code != 0:
+            return
+        self.costs[rule.target] = time.monotonic() - start
+
+        extra = []
+        if compile_command:
+            extra = ([compile_command._depfile] if compile_command._depfile else []) + compile_command._extra_outputs
+        with self.mutex_hash:
+            self.outputs.setdefault(rule.parent, {})[rule.target] = extra
+
+    def report(self, failed : list[Rule], code : int) -> int:
+        '''
+            Log build result, returns build code
+        '''
+        if failed:
+            if code == 0:
+                code = 1
+            logger.error('Error has occurred')
+            if CONFIG.KEEP_GOING:
+                for rule in failed:
+                    logger.error(f'Failed: {rule.target}')
+        else:
+            if any(x[2] for x in self.reasons.values()):
+                logger.info(utils.color_text(32,'Done'))
+            else:
+                logger.info('Nothing to build')
+        return code
+
+    def close(self) -> None:
+        '''
+            Close journal, save build time history and log explanations summary
+        '''
+        self.journal.close()
+
+        if self.cache and self.cache.restored:
+            logger.info(f'Restored from artifact cache: {self.cache.restored}')
+
+        if CONFIG.EXPLAIN and self.reasons:
+            logger.info('Explain: root causes of rebuilds')
+            for root, count in collections.Counter(x[1] for x in self.reasons.values() if x[2]).most_common():
+                logger.info(f'{count:>8} rules: {root}')
+
+        for project, outputs in self.outputs.items():
+            project.save_outputs(project.load_outputs() | outputs)
+
+        if self.costs:
+            history = self.project.load_costs()
+            history.update({os.path.relpath(k, self.project.private_config.CWD): v for k, v in self.costs.items()})
+            utils.save_json(self.project.data_path('costs.json'), history)
+
+#----------------------END BUILD-----------------------
+
 #----------------------PROJECT-------------------------
 
 class ProjectBase():
@@ -189,8 +1271,12 @@ class ProjectBase():
             private_config:ConfigBase = None,
             protected_config:ConfigBase = None,
             public_config:ConfigBase = None,
-            subprojects:list['ProjectBase'] = None
+            subprojects:list['ProjectBase|function'] = None
         ):
+        '''
+            subprojects : projects or functions that make them: def get_project() -> ProjectBase.
+                Functions are run concurrently, see `load_projects`
+        '''
         if not private_config and not protected_config and not public_config:
             raise Exceptions.AtLeastOneConfig()
 
@@ -198,9 +1284,24 @@ class ProjectBase():
         self.target = target
         self.main_rule : Rule = None
         self.rules : list[Rule] = []
-        self.subprojects : list['ProjectBase'] = subprojects if subprojects else []
+        self.subprojects : list['ProjectBase'] = load_projects(subprojects) if subprojects else []
         self.source_names_hash = 0
 
+        self.removed_outputs : dict[str,str] = {}
+        '''
+            Outputs removed before build by mapyr itself: path -> reason.
+            Used to explain rebuilds
+        '''
+
+        # Exact target -> rule index, filled lazily from `rules`
+        self._rules_index : dict[str,Rule] = {}
+        self._rules_indexed : list[Rule] = None
+        self._rules_indexed_count = 0
+
+        # Graph index and state of projects it was made for
+        self._graph_index : GraphIndex = None
+        self._graph_indexed : list[tuple] = None
+
         self.private_config     : ConfigBase = None
         self.public_config      : ConfigBase = None
         self.protected_config   : ConfigBase = None
@@ -231,12 +1332,56 @@ class ProjectBase():
         '''
             Search by target path
         '''
+        rule = self.get_rule(target)
+        if rule:
+            return rule
+
         for rule in self.rules:
             if rule.target.endswith(target):
                 return rule
         return None
 
-    def recursive_run(self, start_node, function, children_container_name, stop_criteria = None):
+    def find_rules(self, target:str) -> list[Rule]:
+        '''
+            Search target in this project and all subprojects.
+            For file which can't be built (source) returns rules that use it directly (objects)
+        '''
+        projects = self.get_projects()
+
+        rule = None
+        for path in [target, os.path.abspath(target), os.path.join(self.private_config.CWD, target)]:
+            rule = next((x for x in (p.get_rule(path) for p in projects) if x), None)
+            if rule:
+                break
+        else:
+            rule = next((x for x in (p.find_rule(target) for p in projects) if x), None)
+
+        if not rule:
+            raise Exceptions.RuleNotFound(target)
+
+        if rule.exec or rule.phony:
+            return [rule]
+
+        dependents = [x for p in projects for x in p.rules if x.exec and not x.phony and rule in x.prerequisites]
+        return utils.unify_list(dependents) or [rule]
+
+    def get_rule(self, target:str) -> Rule|None:
+        '''
+            Search by exact target path or phony name
+        '''
+        if self._rules_indexed is not self.rules:
+            self._rules_index = {}
+            self._rules_indexed = self.rules
+            self._rules_indexed_count = 0
+
+        if self._rules_indexed_count < len(self.rules):
+            for rule in self.rules[self._rules_indexed_count:]:
+                self._rules_index.setdefault(rule.target, rule)
+            self._rules_indexed_count = len(self.rules)
+
+        return self._rules_index.get(target)
+
+    def recursive_run(self, start_node, function, children_container_name, stop_criteria = None, keep_going = False, node_key = None) -> list:
         '''
             Deep first multithreaded recursive function run
             Any type of nodes support
@@ -244,138 +1389,361 @@ class ProjectBase():
             start_node : Rule | Project | ... - node as root of tree
             function : function(node : Rule | Project | ... ) - function will be executed for all nodes
             children_container_name : str - name of class member contains children nodes
-            stop_criteria : function(return_value:Any) -> bool - if true, stops tree walking
+            stop_criteria : function(return_value:Any) -> bool - if true, node is failed and tree walking stops
+            keep_going : bool - don't stop on failure, skip only nodes that depend on failed ones
+            node_key : function(node) -> Hashable - nodes with equal keys are run once, by default node itself
+
+            Returns list of failed nodes
         '''
-        cc = os.cpu_count()
-        threads_num = cc if CONFIG.MAX_THREADS_NUM > cc else CONFIG.MAX_THREADS_NUM
+        scheduler = Scheduler(start_node, children_container_name, node_key, stop_criteria, keep_going)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=scheduler.jobs) as executor:
+            running = {}
+            while running or scheduler.has_ready():
+                while len(running) < scheduler.jobs:
+                    node = scheduler.take_ready()
+                    if node is None:
+                        break
+                    running[executor.submit(function, node)] = node
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    scheduler.finish(running.pop(future), future.result)
+
+        if scheduler.error:
+            raise scheduler.error
+        return scheduler.failed
+
+    async def async_recursive_run(self, start_node, function, children_container_name, stop_criteria = None, keep_going = False, node_key = None, stop_running = False) -> list:
+        '''
+            The same as `recursive_run`, but `function` is coroutine function, nodes run as asyncio tasks.
+            If task is cancelled, running nodes are cancelled too.
 
-        visited = set()
-        stack = []
-        mutex_stack = threading.Lock()
-        mutex_visited = threading.Lock()
-
-        def process_node(_node : Rule):
-            with mutex_visited:
-                if _node in visited:
-                    return 0
-                visited.add(_node)
-
-            children = getattr(_node, children_container_name)
-            if children:
-                with mutex_stack:
-                    if _node in stack:
-                        raise Exceptions.CircularDetected(_node)
-                    stack.append(_node)
-
-                process_subtree(_node)
-
-                with mutex_stack:
-                    stack.remove(_node)
-
-            return function(_node)
-
-        def process_subtree(_node):
-            with concurrent.futures.ThreadPoolExecutor(max_workers=threads_num) as executor:
-                children = getattr(_node, children_container_name)
-                futures = [executor.submit(process_node, child) for child in children]
-                for future in concurrent.futures.as_completed(futures):
-                    if stop_criteria:
-                        if stop_criteria(future.result()):
-                            for f in futures:
-                                f.cancel()
-                            break
-
-        process_node(start_node)
-
-    def rule_recursive_run(self, rule : Rule, function, stop_criteria = None):
-        return self.recursive_run(rule, function, 'prerequisites', stop_criteria)
+            stop_running : on failure cancel running nodes instead of waiting for them (unless keep_going)
+        '''
+        scheduler = Scheduler(start_node, children_container_name, node_key, stop_criteria, keep_going)
+
+        running = {}
+        try:
+            while running or scheduler.has_ready():
+                while len(running) < scheduler.jobs:
+                    node = scheduler.take_ready()
+                    if node is None:
+                        break
+                    running[asyncio.ensure_future(function(node))] = node
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    scheduler.finish(running.pop(task), (lambda: 1) if task.cancelled() else task.result)
+
+                if scheduler.stop and stop_running:
+                    for task in running:
+                        task.cancel()
+        except asyncio.CancelledError:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            raise
+
+        if scheduler.error:
+            raise scheduler.error
+        return scheduler.failed
+
+    def rule_recursive_run(self, rule : Rule, function, stop_criteria = None, keep_going = False):
+        # Different rules of one file (e.g. from several variants of project) are the same job
+        return self.recursive_run(rule, function, 'prerequisites', stop_criteria, keep_going, _rule_key)
 
     def project_recursive_run(self, function, stop_criteria = None):
         return self.recursive_run(self, function, 'subprojects', stop_criteria)
 
+    def get_projects(self) -> list['ProjectBase']:
+        '''
+            This project and all subprojects recursively
+        '''
+        result = []
+        stack = [self]
+        while stack:
+            project = stack.pop()
+            if project not in result:
+                result.append(project)
+                stack.extend(reversed(project.subprojects))
+        return result
+
+    def get_graph_index(self) -> GraphIndex:
+        '''
+            Dependency graph index over rules of this project and all subprojects.
+            Index is made once and kept while `rules` and `main_rule` of the projects are the same
+            (rules lists are not replaced or resized). Prerequisites of existing rules are not tracked
+        '''
+        state = [(p, p.rules, len(p.rules), p.main_rule) for p in self.get_projects()]
+        indexed = self._graph_indexed
+        if indexed is None or len(indexed) != len(state) \
+            or any(a[0] is not b[0] or a[1] is not b[1] or a[2] != b[2] or a[3] is not b[3] for a, b in zip(indexed, state)):
+            self._graph_index = GraphIndex([x[0] for x in state])
+            self._graph_indexed = state
+        return self._graph_index
+
+    def query(self, kind:str, targets:list[str]) -> list[Rule]|list[list[Rule]]:
+        '''
+            Query dependency graph
+            kind : 'deps' | 'rdeps' | 'affected' | 'paths'
+            targets : target for 'deps' and 'rdeps', changed files for 'affected', start and end targets for 'paths'
+        '''
+        index = self.get_graph_index()
+        match kind:
+            case 'deps'|'rdeps':
+                result = []
+                for target in targets:
+                    result.extend(getattr(index, kind)(target))
+                return list(dict.fromkeys(result))
+            case 'affected':
+                return index.affected(targets)
+            case 'paths':
+                if len(targets) != 2:
+                    raise ValueError('paths query requires start and end targets')
+                return index.paths(targets[0], targets[1])
+        raise ValueError(f'Unknown query: {kind}')
+
+    def data_path(self, *names:str) -> str:
+        '''
+            Path in mapyr data directory of the project. See `ToolConfig.DATA_PATH`
+        '''
+        return os.path.join(self.private_config.CWD, CONFIG.DATA_PATH, *names)
+
+    def before_build(self) -> None:
+        '''
+            Called before build of the project targets
+        '''
+        pass
+
+    def after_build(self, code:int) -> None:
+        '''
+            Called after build of the project targets with build result code
+        '''
+        pass
+
     def build(self, rule : Rule) -> int:
-        bulilded_rules = []
+        return build_rules([(self, rule)])
 
-        def _exec_rule(_rule : Rule) -> int:
-            if _rule.exec:
-                compile_command : CompileCommand = _rule.exec(_rule)
-                if compile_command:
-                    if compile_command._name:
-                        logger.info(f"{compile_command._name}: {os.path.relpath(compile_command.output)}")
+    def _build(self, rule : Rule, frozen : set[str] = None) -> int:
+        '''
+            Build rule and all its prerequisites
 
-                    if compile_command.arguments:
-                        return utils.sh(compile_command.arguments,cwd=compile_command.directory).returncode
-                    elif compile_command.command:
-                        return utils.sh(compile_command.command,cwd=compile_command.directory).returncode
+            frozen : targets that must not be built, only checked for existence
+        '''
+        session = BuildSession(self, frozen)
+
+        def _build(_rule : Rule) -> int:
+            if not session.need_exec(_rule):
+                return 0
+
+            code = 0
+            start = time.monotonic()
+            compile_command : CompileCommand = session.get_command(_rule)
+            if inspect.isawaitable(compile_command):
+                compile_command = asyncio.run(_await(compile_command))
+
+            if compile_command and (compile_command.arguments or compile_command.command):
+                arguments, temp_output = session.start_command(_rule, compile_command)
+                code = 1
+                try:
+                    if session.restore(_rule, compile_command, temp_output):
+                        code = 0
                     else:
-                        return 0
-            return 0
+                        code = utils.sh(arguments,cwd=compile_command.directory).returncode
+                finally:
+                    code = session.finish_command(_rule, compile_command, temp_output, code)
+                session.store(_rule, compile_command, code)
+            elif compile_command and compile_command._name:
+                logger.info(f"{compile_command._name}: {os.path.relpath(compile_command.output)}")
 
-        mutex_hash = threading.Lock()
+            session.rule_done(_rule, compile_command, start, code)
+            return code
 
-        def _build(_rule : Rule) -> int:
+        code = 0
+        def _stop_criteria(value) -> bool:
+            nonlocal code
+            if value != 0:
+                if code == 0:
+                    code = value
+                if CONFIG.FAIL_FAST and not CONFIG.KEEP_GOING:
+                    utils.terminate_children()
+                return True
+            return False
 
-            if _rule.phony:
-                return _exec_rule(_rule)
-
-            # Hash source names calculation
-            hash_sum = 0
-            for prq in _rule.prerequisites:
-                hash_sum = utils.stable_hash(prq.target)
-            hash_sum + utils.stable_hash(_rule.target)
-
-            with mutex_hash:
-                _rule.parent.source_names_hash += hash_sum
-
-            if not os.path.isabs(_rule.target):
-                _rule.target = f'{_rule.parent.private_config.CWD}/{_rule.target}'
-
-            # Target doesn't exists
-            if not os.path.exists(_rule.target):
-                return _exec_rule(_rule)
-
-            # Prerequisite is newer
-            out_date = os.path.getmtime(_rule.target)
-            for prq in _rule.prerequisites:
-                if not os.path.isabs(prq.target):
-                    prq.target = f'{prq.parent.private_config.CWD}/{prq.target}'
-
-                if not os.path.exists(prq.target):
-                    raise Exceptions.PrerequisiteNotFound(f': {os.path.relpath(prq.target,prq.parent.private_config.CWD)}')
-                src_date = os.path.getmtime(prq.target)
-                if src_date > out_date:
-                    bulilded_rules.append(_rule)
-                    if _rule.exec:
-                        return _exec_rule(_rule)
+        utils.allow_children()
+        session.start()
+        try:
+            failed = self.rule_recursive_run(rule, _build, _stop_criteria, CONFIG.KEEP_GOING)
+            code = session.report(failed, code)
+        except Exception as e:
+            logger.error(f'{e}')
+            code = 1
+        finally:
+            session.close()
+
+        return code
+
+    async def build_async(self, rule : Rule, events : asyncio.Queue = None) -> int:
+        '''
+            Build rule and all its prerequisites in running event loop.
+            Commands run as asyncio subprocesses, `exec` functions can be `async def`.
+            If task is cancelled, running commands are killed.
+
+            events : queue for `BuildEvent` progress events
+        '''
+        def _event(kind : str, _rule : Rule, code : int = None, output : str = None):
+            if events is not None:
+                events.put_nowait(BuildEvent(kind, _rule, code, output))
+
+        self.before_build()
+        session = BuildSession(self)
+
+        async def _build(_rule : Rule) -> int:
+            if not session.need_exec(_rule):
+                return 0
+
+            code = 0
+            output = None
+            start = time.monotonic()
+
+            # Blocking work (sync exec functions, artifact cache I/O) runs in threads, not in event loop
+            if inspect.iscoroutinefunction(_rule.exec):
+                compile_command : CompileCommand = await session.get_command(_rule)
+            else:
+                compile_command : CompileCommand = await asyncio.to_thread(session.get_command, _rule)
+                if inspect.isawaitable(compile_command):
+                    compile_command = await compile_command
+
+            if compile_command and (compile_command.arguments or compile_command.command):
+                arguments, temp_output = session.start_command(_rule, compile_command)
+                _event('started', _rule)
+                code = 1
+                try:
+                    if await asyncio.to_thread(session.restore, _rule, compile_command, temp_output):
+                        code = 0
                     else:
-                        # Not buildable targets cannot be updated naturally
-                        # so update them artificially to avoid endless rebuilds
-                        os.utime(_rule.target)
+                        code, output = await _run_async(arguments, compile_command.directory)
+                finally:
+                    code = session.finish_command(_rule, compile_command, temp_output, code)
+                await asyncio.to_thread(session.store, _rule, compile_command, code)
+            elif compile_command and compile_command._name:
+                logger.info(f"{compile_command._name}: {os.path.relpath(compile_command.output)}")
 
-            return 0
+            session.rule_done(_rule, compile_command, start, code)
+            _event('finished', _rule, code, output)
+            return code
 
         code = 0
         def _stop_criteria(value) -> bool:
             nonlocal code
             if value != 0:
-                code = value
+                if code == 0:
+                    code = value
                 return True
             return False
 
+        session.start()
         try:
-            self.rule_recursive_run(rule, _build, _stop_criteria)
-            if code != 0:
-                logger.error('Error has occurred')
-            else:
-                if bulilded_rules:
-                    logger.info(utils.color_text(32,'Done'))
-                else:
-                    logger.info('Nothing to build')
+            failed = await self.async_recursive_run(rule, _build, 'prerequisites', _stop_criteria,
+                CONFIG.KEEP_GOING, _rule_key, CONFIG.FAIL_FAST)
+            code = session.report(failed, code)
+        except asyncio.CancelledError:
+            code = -signal.SIGTERM
+            raise
         except Exception as e:
             logger.error(f'{e}')
+            code = 1
+        finally:
+            session.close()
+            self.after_build(code)
+            _event('done', rule, code)
 
         return code
 
+    def load_outputs(self) -> dict[str,list[str]]:
+        '''
+            Outputs produced by builds of the project: target -> other outputs of its rule (depfiles...), absolute paths
+        '''
+        cwd = self.private_config.CWD
+        data = utils.load_json(self.data_path('outputs.json'), {})
+        return {os.path.join(cwd, k): [os.path.join(cwd, x) for x in v] for k, v in data.items()}
+
+    def save_outputs(self, outputs : dict[str,list[str]]) -> None:
+        cwd = self.private_config.CWD
+        utils.save_json(self.data_path('outputs.json'), {os.path.relpath(k, cwd): [os.path.relpath(x, cwd) for x in v] for k, v in outputs.items()})
+
+    def clean(self, rules : list[Rule] = None) -> int:
+        '''
+            Remove outputs produced by builds of this project and all subprojects, files are removed in parallel.
+            Returns number of removed files
+
+            rules : remove only outputs of these rules and their prerequisites
+        '''
+        subgraph = None
+        if rules is not None:
+            subgraph = set()
+            stack = list(rules)
+            while stack:
+                rule = stack.pop()
+                if not rule.phony:
+                    if rule.target in subgraph:
+                        continue
+                    subgraph.add(rule.target)
+                if rule.prerequisites:
+                    stack.extend(rule.prerequisites)
+
+        # Targets to remove and all recorded outputs of projects
+        removes = {}
+        outputs = {}
+        for project in self.get_projects():
+            outputs[project] = project.load_outputs()
+            removes[project] = [x for x in outputs[project] if subgraph is None or x in subgraph]
+
+        files = [x for project, targets in removes.items() for target in targets for x in [target] + outputs[project][target]]
+
+        def _remove(path):
+            try:
+                os.remove(path)
+                return 1
+            except FileNotFoundError:
+                return 0
+        cc = os.cpu_count()
+        threads_num = cc if CONFIG.MAX_THREADS_NUM > cc else CONFIG.MAX_THREADS_NUM
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads_num) as executor:
+            removed = sum(executor.map(_remove, files))
+
+        # Remove directories left empty, but not project directories
+        keep = set(x.private_config.CWD for x in removes)
+        dirs = set()
+        for path in files:
+            path = os.path.dirname(path)
+            while path not in dirs and path not in keep and path != os.path.dirname(path):
+                if not any(path.startswith(f'{x}/') for x in keep):
+                    break
+                dirs.add(path)
+                path = os.path.dirname(path)
+        for path in sorted(dirs, key=len, reverse=True):
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+
+        for project, targets in removes.items():
+            if targets:
+                for target in targets:
+                    del outputs[project][target]
+                project.save_outputs(outputs[project])
+
+        logger.info(f'Removed {removed} files')
+        return removed
+
+    def load_costs(self) -> dict[str,float]:
+        '''
+            Build time history: target path relative to project directory -> seconds
+        '''
+        return utils.load_json(self.data_path('costs.json'), {})
+
     def get_compile_commands(self) -> list[dict]:
         result = []
 
@@ -395,6 +1763,193 @@ class ProjectBase():
         self.rule_recursive_run(self.main_rule, _compile_commands)
         return result
 
+def _rule_key(rule:Rule):
+    return rule if rule.phony else rule.target
+
+def _relpath(rule:Rule, cwd:str) -> str:
+    return rule.target if rule.phony else os.path.relpath(rule.target, cwd)
+
+async def _await(awaitable):
+    return await awaitable
+
+async def _run_async(cmd : list[str]|str, cwd : str = None) -> tuple[int,str]:
+    '''
+        Run command as asyncio subprocess, returns (code, output).
+        Process and its children are killed if task is cancelled
+    '''
+    logger.debug(cmd)
+    if type(cmd) is not list:
+        cmd = shlex.split(cmd)
+
+    # Own process group, so children of command (compiler driver -> cc1, as, ld) can be killed too
+    process = await asyncio.create_subprocess_exec(*cmd, cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        start_new_session=True)
+    try:
+        output, _ = await process.communicate()
+    except asyncio.CancelledError:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await process.wait()
+        raise
+
+    output = output.decode('utf-8', errors='replace')
+    logger.debug(output)
+    return process.returncode, output
+
+def get_shardable_rules(rule:Rule) -> list[Rule]:
+    '''
+        Object level rules of the graph: buildable rules that are not
+        main rules of projects and don't depend on them
+    '''
+    order = []
+    visited = set()
+    stack = [(rule, False)]
+    while stack:
+        node, done = stack.pop()
+        if done:
+            order.append(node)
+            continue
+        if node in visited:
+            continue
+        visited.add(node)
+        stack.append((node, True))
+        stack.extend((x, False) for x in node.prerequisites)
+
+    # Children are before parents in `order`
+    final = set()
+    for node in order:
+        if node.parent.main_rule is node or any(x in final for x in node.prerequisites):
+            final.add(node)
+
+    result = {}
+    for node in order:
+        if node.exec and not node.phony and node not in final:
+            result.setdefault(node.target, node)
+    return list(result.values())
+
+def shard_rules(project:ProjectBase, rules:list[Rule], index:int, count:int) -> list[Rule]:
+    '''
+        Deterministically split rules into `count` parts by cost and return `index`-th (from 1) part.
+        Cost is build time from project history, rules without history are estimated by sources size
+    '''
+    history = project.load_costs()
+
+    def _key(_rule:Rule) -> str:
+        return os.path.relpath(_rule.target, project.private_config.CWD)
+
+    def _size(_rule:Rule) -> int:
+        return sum(max(utils.get_size(x.target), 0) for x in _rule.prerequisites if not x.exec and not x.phony) or 1
+
+    # Seconds per byte by rules with history, to estimate the rest
+    known = [x for x in rules if _key(x) in history]
+    known_size = sum(_size(x) for x in known)
+    rate = sum(history[_key(x)] for x in known) / known_size if known_size else 1
+
+    costs = {x: history[_key(x)] if _key(x) in history else _size(x) * rate for x in rules}
+
+    loads = [0.0] * count
+    result = []
+    for rule in sorted(rules, key=lambda x: (-costs[x], _key(x))):
+        shard = loads.index(min(loads))
+        loads[shard] += costs[rule]
+        if shard == index - 1:
+            result.append(rule)
+    return result
+
+def build_rules(targets:list[tuple[ProjectBase,Rule]]) -> int:
+    '''
+        Build rules of one or several projects (e.g. variants) in one pass
+
+        targets : list of (project, rule) - rule and project where it was found
+    '''
+    projects = utils.unify_list([x[0] for x in targets])
+    rules = utils.unify_list([x[1] for x in targets])
+
+    for project in projects:
+        project.before_build()
+
+    if len(rules) == 1:
+        rule = rules[0]
+    else:
+        rule = Rule('build', projects[0], rules, phony=True)
+
+    frozen = None
+    if CONFIG.SHARD:
+        shardable = get_shardable_rules(rule)
+        if CONFIG.SHARD == 'merge':
+            frozen = set(x.target for x in shardable)
+        else:
+            index, count = [int(x) for x in CONFIG.SHARD.split('/')]
+            if not 1 <= index <= count:
+                raise ValueError(f'Wrong shard: {CONFIG.SHARD}')
+            part = shard_rules(projects[0], shardable, index, count)
+            logger.info(f'Shard {index}/{count}: {len(part)} of {len(shardable)} rules')
+            rule = Rule('shard', projects[0], part, phony=True)
+
+    code = projects[0]._build(rule, frozen)
+
+    for project in projects:
+        project.after_build(code)
+
+    if get_profiler():
+        get_profiler().save()
+
+    return code
+
+_configuration : contextvars.ContextVar = contextvars.ContextVar('mapyr_configuration', default=None)
+_configuration_lock = threading.Lock()
+
+def configuration_cache(name:str) -> dict:
+    '''
+        Cache shared by projects configured by one `load_projects` call (with nested calls for subprojects),
+        e.g. variants of `process`. It is dropped when configuration is finished, so later configurations
+        see new files. Outside of `load_projects` every call returns new empty dict
+    '''
+    caches = _configuration.get()
+    if caches is None:
+        return {}
+    with _configuration_lock:
+        return caches.setdefault(name, {})
+
+def load_projects(items:list['ProjectBase|function']) -> list[ProjectBase]:
+    '''
+        Make list of projects from projects and functions that make them: def get_project() -> ProjectBase.
+        Functions (graphs construction: sources search, '.d' files parsing...) are run concurrently in threads,
+        result order is the same as order of items. Functions share `configuration_cache`
+    '''
+    if not any(callable(x) for x in items):
+        return list(items)
+
+    cc = os.cpu_count()
+    threads_num = cc if CONFIG.MAX_THREADS_NUM > cc else CONFIG.MAX_THREADS_NUM
+
+    def _configure(fnc):
+        with profile_phase('configure'):
+            return fnc()
+
+    token = _configuration.set({}) if _configuration.get() is None else None
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads_num) as executor:
+            # Every thread gets copy of context with the same caches
+            results = [executor.submit(contextvars.copy_context().run, _configure, x) if callable(x) else x for x in items]
+            return [x.result() if isinstance(x, concurrent.futures.Future) else x for x in results]
+    finally:
+        if token is not None:
+            _configuration.reset(token)
+
+def _has_target(projects:list[ProjectBase], target:str) -> bool:
+    '''
+        Exact match only: phony name or path (absolute, relative to working or project directory).
+        Suffix search of `find_rule` would take project names like 'main' for 'bin/main'
+    '''
+    for project in projects:
+        paths = [target, os.path.abspath(target), os.path.join(project.private_config.CWD, target)]
+        if any(p.get_rule(path) for p in project.get_projects() for path in paths):
+            return True
+    return False
+
 #----------------------END PROJECT---------------------
 
 def process(get_project_fnc, get_config_fnc=None):
@@ -409,23 +1964,84 @@ def process(get_project_fnc, get_config_fnc=None):
     if CONFIG.MINIMUM_REQUIRED_VERSION > VERSION:
         logger.warning(f"Required version {CONFIG.MINIMUM_REQUIRED_VERSION} is higher than running {VERSION}!")
 
-    project_name = 'main'
-    target = 'build'
-
-    match len(sys.argv):
-        case 1:pass
-        case 2:
-            target = sys.argv[1]
-        case 3|_:
-            project_name = sys.argv[1]
-            target = sys.argv[2]
+    parser = argparse.ArgumentParser(description=f'Mapyr v.{VERSION}')
+    parser.add_argument('args', nargs='*', metavar='[project] target', help='Project name (if -p not used) and targets: phony names or paths of objects, sources, binaries... By default: main build')
+    parser.add_argument('-p', '--project', action='append', default=[], help='Project name or comma separated names, can be repeated. All projects are built in one pass')
+    parser.add_argument('-k', '--keep-going', action='store_true', help='Build everything that not depends on failed rules')
+    parser.add_argument('--fail-fast', action='store_true', help='Terminate running jobs on first error')
+    parser.add_argument('--explain', action='store_true', help='Log why every rule is executed')
+    parser.add_argument('--shard', metavar='i/N|merge', help='Build only i-th of N parts of objects, or link objects built by all shards')
+    parser.add_argument('--clean', action='store_true', help='Remove outputs of targets and their prerequisites instead of build')
+    parser.add_argument('--cache', metavar='DIR|URL', help='Artifact cache: directory or URL of cache server')
+    parser.add_argument('--profile', choices=['cprofile', 'sample'], help='Profile configuration phase and exec functions of rules')
+    args = parser.parse_args()
+
+    if args.keep_going:
+        CONFIG.KEEP_GOING = True
+    if args.fail_fast:
+        CONFIG.FAIL_FAST = True
+    if args.explain:
+        CONFIG.EXPLAIN = True
+    if args.shard:
+        CONFIG.SHARD = args.shard
+    if args.profile:
+        CONFIG.PROFILE = args.profile
+    if args.cache:
+        CONFIG.ARTIFACT_CACHE = args.cache
+
+    project_names = args.project
+    target_names = args.args
+
+    # Without -p first of several arguments is project name, unless it is target of the project
+    positional_project = not project_names and len(target_names) > 1 and target_names[0] not in ('query', 'ninja')
+    if positional_project:
+        project_names = [target_names[0]]
+        target_names = target_names[1:]
+
+    project_names = utils.unify_list([x for names in project_names for x in names.split(',') if x]) or ['main']
+    target_names = target_names or ['build']
 
     try:
-        project : ProjectBase = get_project_fnc(project_name)
-        rule = project.find_rule(target)
-        if not rule:
-            raise Exceptions.RuleNotFound(target)
-        code = project.build(rule)
+        if target_names[0] == 'query':
+            if len(target_names) < 3:
+                raise ValueError('Usage: query deps|rdeps|affected|paths targets...')
+            with profile_phase('configure', all_threads=True):
+                project : ProjectBase = get_project_fnc(project_names[0])
+            cwd = project.private_config.CWD
+            result = project.query(target_names[1], target_names[2:])
+            for item in result:
+                if type(item) is list:
+                    print(' -> '.join(_relpath(x, cwd) for x in item))
+                else:
+                    print(_relpath(item, cwd))
+            exit(0)
+
+        with profile_phase('configure', all_threads=True):
+            projects = load_projects([functools.partial(get_project_fnc, x) for x in project_names])
+            if positional_project and _has_target(projects, project_names[0]):
+                logger.warning(f"'{project_names[0]}' is built as target, not used as project name. Use -p to pass project name")
+                target_names = project_names + target_names
+                project_names = ['main']
+                projects = load_projects([functools.partial(get_project_fnc, x) for x in project_names])
+        if get_profiler():
+            get_profiler().save()
+
+        if target_names[0] == 'ninja':
+            from . import ninja
+            ninja.export(projects, target_names[1] if len(target_names) > 1 else 'build.ninja', project_names, utils.caller_file())
+            exit(0)
+
+        if args.clean:
+            for project in projects:
+                project.clean([x for name in target_names for x in project.find_rules(name)])
+            exit(0)
+
+        # Clean can't run together with build, it goes first
+        code = 0
+        for names in [[x for x in target_names if x == 'clean'], [x for x in target_names if x != 'clean']]:
+            targets = [(p, x) for p in projects for name in names for x in p.find_rules(name)]
+            if targets and code == 0:
+                code = build_rules(targets)
         exit(code)
     except Exception as e:
         logger.error(traceback.format_exc())
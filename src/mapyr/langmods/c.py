@@ -1,12 +1,22 @@
 from ..core import *
+from .. import core
 from ..logs import logger
 from ..utils import *
 
 import json
 import re
+import threading
+import hashlib
+import subprocess
+import collections
+
+LINK_POOL = 'link'
+'''
+    Resource pool of link rules. See `ToolConfig.POOLS`
+'''
 
 class Config(ConfigBase):
-    dir_members = ['TARGET_PATH','SRC_DIRS','OBJ_PATH','INCLUDE_DIRS','LIB_DIRS','SOURCES']
+    dir_members = ['TARGET_PATH','SRC_DIRS','OBJ_PATH','INCLUDE_DIRS','LIB_DIRS','RPATH_DIRS','SOURCES']
 
     def __init__(self) -> None:
         super().__init__()
@@ -42,6 +52,16 @@ class Config(ConfigBase):
             Archiver flags
         '''
 
+        self.AR_THIN : bool = False
+        '''
+            Make thin static archives: archive keeps paths to objects instead of copies
+        '''
+
+        self.NM : str = 'nm'
+        '''
+            Symbols lister, used to get interface of shared libraries
+        '''
+
         self.CFLAGS : list[str] = []
         '''
             Compile flags
@@ -52,6 +72,28 @@ class Config(ConfigBase):
             Flags used while linking
         '''
 
+        self.LINKER : str = None
+        '''
+            Linker used by compiler driver (`-fuse-ld=`): 'lld', 'mold', 'gold'... None - default linker
+        '''
+
+        self.SPLIT_DWARF : bool = False
+        '''
+            Put debug info of objects to separate '.dwo' files (`-gsplit-dwarf`), so linker doesn't process it.
+            Debug info must be enabled in CFLAGS (`-g`)
+        '''
+
+        self.LTO : str = None
+        '''
+            Link time optimization: 'thin' or 'full'. GCC has one mode, parallel by partitions
+        '''
+
+        self.LTO_JOBS : int = None
+        '''
+            Parallel jobs of LTO code generation of one link.
+            None - build threads divided among links running at the same time (size of link pool)
+        '''
+
         self.LIB_DIRS : list[str] = []
         '''
             Directories where looking for libraries
@@ -62,6 +104,11 @@ class Config(ConfigBase):
             List of libraries
         '''
 
+        self.RPATH_DIRS : list[str] = []
+        '''
+            Directories where shared libraries are looked for at run time
+        '''
+
         self.DEFINES : list[str] = []
         '''
             Defines used in this project and all its children
@@ -82,23 +129,87 @@ class Config(ConfigBase):
             Generate compile_commands.json
         '''
 
+        self.SCAN_INCLUDES : bool = False
+        '''
+            Find headers of sources by `#include` directives before compilation. See `add_rules_from_includes`
+        '''
+
     def get_build_string(self) -> str:
         '''
-            Config string need to sign config of built files
-            If any flag, that influences on the result file was changed then need to rebuild all targets
+            Config string need to sign config of built objects
+            If any flag, that influences on the result file was changed then need to rebuild all objects
         '''
         lst = [
-            self.AR,
             self.COMPILER,
+            get_compiler_info(self.COMPILER)['version'],
             self.CFLAGS,
             self.DEFINES,
+            self.get_compile_flags(),
+        ]
+        return str(lst)
+
+    def get_link_string(self) -> str:
+        '''
+            Config string need to sign config of linked target.
+            If it changed only target is linked again, objects are kept
+        '''
+        lst = [
+            self.AR,
+            self.AR_FLAGS,
+            self.COMPILER,
+            get_compiler_info(self.COMPILER)['version'],
             self.LINK_FLAGS,
+            self.LINKER,
+            self.LTO,
         ]
         return str(lst)
 
+    def is_clang(self) -> bool:
+        return 'clang' in get_compiler_info(self.COMPILER)['version'].lower()
+
+    def get_lto_jobs(self) -> int:
+        '''
+            Parallel jobs of LTO code generation of one link, see `LTO_JOBS`
+        '''
+        if self.LTO_JOBS:
+            return self.LTO_JOBS
+
+        # Module CONFIG is replaced by `process`, read actual one
+        cc = os.cpu_count() or 1
+        slots = cc if core.CONFIG.MAX_THREADS_NUM > cc else core.CONFIG.MAX_THREADS_NUM
+        return max(1, slots // core.CONFIG.POOLS.get(LINK_POOL, 1))
+
+    def get_compile_flags(self) -> list[str]:
+        '''
+            Compile flags made from options: SPLIT_DWARF, LTO
+        '''
+        result = []
+        if self.SPLIT_DWARF:
+            result.append('-gsplit-dwarf')
+        if self.LTO:
+            result.append(f'-flto={self.LTO}' if self.is_clang() else '-flto')
+        return result
+
+    def get_link_flags(self) -> list[str]:
+        '''
+            Link flags made from options: LINKER, LTO, LTO_JOBS
+        '''
+        result = []
+        if self.LINKER:
+            result.append(f'-fuse-ld={self.LINKER}')
+        if self.LTO:
+            if not self.is_clang():
+                result.append(f'-flto={self.get_lto_jobs()}')
+            elif self.LTO == 'thin':
+                # Driver flag, clang passes it in form of used linker: lld, gold plugin or ld64
+                result += ['-flto=thin', f'-flto-jobs={self.get_lto_jobs()}']
+            else:
+                result.append(f'-flto={self.LTO}')
+        return result
+
     def extend(self, other:'Config', members : list[str] = None):
         if not members:
-            members = ['DEFINES','INCLUDE_DIRS','LIBS','LIB_DIRS']
+            members = ['DEFINES','INCLUDE_DIRS','LIBS','LIB_DIRS','RPATH_DIRS']
 
         for member in members:
             getattr(self, member).extend(getattr(other, member))
@@ -118,6 +229,11 @@ class Project(ProjectBase):
         self.protected_config   : Config
         self.public_config      : Config
 
+        self.interface_rule     : Rule = None
+        '''
+            Rule of shared library interface (exported symbols), dependents use it instead of main rule
+        '''
+
     def delete_objects_if_config_different(self):
         '''
             If already built objects config not match current config
@@ -129,13 +245,44 @@ class Project(ProjectBase):
             ap = os.path.join(self.private_config.CWD, self.private_config.OBJ_PATH)
 
         cfg_path = os.path.join(ap,'config_tag')
+        build_string = self.private_config.get_build_string()
+        current = None
         if os.path.exists(cfg_path):
             with open(cfg_path, 'r') as f:
-                if f.read() != self.private_config.get_build_string():
-                    silentremove(ap)
+                current = f.read()
+            if current != build_string:
+                silentremove(ap)
+                self.removed_outputs[ap] = 'config_tag changed'
+
+        # From now all objects are built with current config
+        if current != build_string:
+            os.makedirs(ap,exist_ok=True)
+            with open(cfg_path,'w+') as f:
+                f.write(build_string)
+
+        # Link options changed: only main target is linked again
+        link_path = os.path.join(ap,'link_tag')
+        link_string = self.private_config.get_link_string()
+        current = None
+        if os.path.exists(link_path):
+            with open(link_path, 'r') as f:
+                current = f.read()
+            if current != link_string and self.main_rule:
+                silentremove(self.main_rule.target)
+                self.removed_outputs[self.main_rule.target] = 'link_tag changed'
+
+        if current != link_string:
+            with open(link_path,'w+') as f:
+                f.write(link_string)
+
+        # Static archive kind changed
+        members = load_json(os.path.join(ap, f'{os.path.basename(self.target)}.members'))
+        if members and members['thin'] != self.private_config.AR_THIN and self.main_rule:
+            silentremove(self.main_rule.target)
+            self.removed_outputs[self.main_rule.target] = 'archive kind changed'
         return 0
 
-    def build(self, rule:Rule):
+    def before_build(self):
         # Before build, make all configs absolute path
         def _set_absolute_config_paths(project:ProjectBase):
             if type(project) is Project:
@@ -155,8 +302,7 @@ class Project(ProjectBase):
         self.project_recursive_run(_set_absolute_config_paths)
         self.project_recursive_run(_check_config)
 
-        code = super().build(rule)
-
+    def after_build(self, code:int):
         # Making compile commands
         if self.private_config.COMPILE_COMMANDS and code == 0:
             if os.path.isabs(self.private_config.OBJ_PATH):
@@ -184,8 +330,6 @@ class Project(ProjectBase):
         if self.private_config.VSCODE_CPPTOOLS_CONFIG:
             vscode_make_cpp_properties(self)
 
-        return code
-
 def vscode_make_cpp_properties(project:ProjectBase):
     '''
         For visual studio code, С/С++ extension.
@@ -194,8 +338,7 @@ def vscode_make_cpp_properties(project:ProjectBase):
 
     vscode_file_path = f'{cfg.CWD}/.vscode/c_cpp_properties.json'
     if os.path.exists(vscode_file_path):
-        import inspect
-        build_py_filename = inspect.stack()[2].filename
+        build_py_filename = caller_file()
         if os.path.getmtime(build_py_filename) <= os.path.getmtime(vscode_file_path):
             return
     else:
@@ -227,22 +370,29 @@ def build_object(rule:Rule) -> CompileCommand:
     compile_command.file = rule.prerequisites[0].target
     compile_command.directory = cfg.CWD
     compile_command.output = rule.target
+    compile_command._identity = get_compiler_info(cfg.COMPILER)['version']
 
     compile_command.arguments = \
         [cfg.COMPILER,'-MT','','-MMD','-MP','-MF',''] \
         + cfg.CFLAGS \
+        + cfg.get_compile_flags() \
         + [f"-D{x}" for x in cfg.DEFINES] \
         + [f"-I{x}" for x in cfg.INCLUDE_DIRS] \
         + ['-c','-o','','']
 
     path_wo_ext     = os.path.splitext(rule.target)[0]
     compile_command.arguments[2]    = rule.prerequisites[0].target
-    compile_command.arguments[6]    = f"{path_wo_ext}.d"
+    compile_command.arguments[6]    = compile_command._depfile = f"{path_wo_ext}.d"
     compile_command.arguments[-2]   = rule.target
     compile_command.arguments[-1]   = rule.prerequisites[0].target
     # mapyr special flags
     compile_command.arguments.insert(7, f'-D__MAPYR__FILENAME__="{os.path.basename(rule.prerequisites[0].target)}"')
 
+    if cfg.SPLIT_DWARF:
+        # '.dwo' name is made from output name and written into object, so output can't be renamed
+        compile_command._extra_outputs = [f"{path_wo_ext}.dwo"]
+        compile_command._atomic = False
+
     return compile_command
 
 def link_executable(rule:Rule) -> CompileCommand:
@@ -256,81 +406,257 @@ def link_executable(rule:Rule) -> CompileCommand:
     compile_command._name = color_text(32,'Linking executable')
     compile_command.directory = cfg.CWD
     compile_command.output = rule.target
+    compile_command._identity = get_compiler_info(cfg.COMPILER)['version']
 
     compile_command.arguments = [cfg.COMPILER] \
     + cfg.LINK_FLAGS \
+    + cfg.get_link_flags() \
     + [f"-L{x}" for x in cfg.LIB_DIRS] \
     + [x.target for x in rule.prerequisites if not x.phony and x.target.endswith('.o')] \
     + ['-o',rule.target] \
-    + [f"-l{x}" for x in cfg.LIBS]
+    + [f"-l{x}" for x in cfg.LIBS] \
+    + [f"-Wl,-rpath,{x}" for x in cfg.RPATH_DIRS]
 
-    abs_dir_obj=os.path.join(cfg.CWD, cfg.OBJ_PATH)
-    if not os.path.exists(abs_dir_obj):
-        os.makedirs(abs_dir_obj,exist_ok=True)
-    with open(os.path.join(abs_dir_obj,'config_tag'),'w+') as f:
-        f.write(cfg.get_build_string())
+    return compile_command
+
+def link_shared(rule:Rule) -> CompileCommand:
+    cfg : Config = rule.parent.private_config
+
+    dirn = os.path.dirname(rule.target)
+    if dirn:
+        os.makedirs(dirn,exist_ok=True)
+
+    compile_command = CompileCommand()
+    compile_command._name = color_text(36,'Linking shared')
+    compile_command.directory = cfg.CWD
+    compile_command.output = rule.target
+    compile_command._identity = get_compiler_info(cfg.COMPILER)['version']
+
+    compile_command.arguments = [cfg.COMPILER,'-shared',f'-Wl,-soname,{os.path.basename(rule.target)}'] \
+    + cfg.LINK_FLAGS \
+    + cfg.get_link_flags() \
+    + [f"-L{x}" for x in cfg.LIB_DIRS] \
+    + [x.target for x in rule.prerequisites if not x.phony and x.target.endswith('.o')] \
+    + ['-o',rule.target] \
+    + [f"-l{x}" for x in cfg.LIBS] \
+    + [f"-Wl,-rpath,{x}" for x in cfg.RPATH_DIRS]
 
     return compile_command
 
+def get_interface(library:str, nm:str = 'nm') -> str:
+    '''
+        Exported dynamic symbols of shared library: sorted lines '<name> <type>'.
+        If symbols can't be listed, library content hash is used, so every change is interface change
+    '''
+    result = subprocess.run([nm,'-D','--defined-only','--format=posix',library], capture_output=True, text=True)
+    if result.returncode == 0:
+        symbols = set(' '.join(line.split()[:2]) for line in result.stdout.splitlines() if line.strip())
+        return ''.join(f'{x}\n' for x in sorted(symbols))
+
+    with open(library,'rb') as f:
+        return f'{hashlib.sha256(f.read()).hexdigest()}\n'
+
+def update_interface(rule:Rule) -> CompileCommand:
+    '''
+        Write interface of shared library (first prerequisite) to target.
+        Target is updated only if interface changed, rules depending on it
+        (executables linked with library) are not rebuilt on implementation changes.
+        Stamp of the check is always updated, so interface is not listed again until library changes
+    '''
+    cfg : Config = rule.parent.private_config
+    interface = get_interface(rule.prerequisites[0].target, cfg.NM)
+
+    current = None
+    if os.path.exists(rule.target):
+        with open(rule.target,'r') as f:
+            current = f.read()
+
+    os.makedirs(os.path.dirname(rule.target),exist_ok=True)
+    if current != interface:
+        temp_path = temp_output_path(rule.target)
+        with open(temp_path,'w') as f:
+            f.write(interface)
+        os.replace(temp_path, rule.target)
+
+    stamp = stamp_path(rule.target)
+    with open(stamp,'a'):
+        pass
+    os.utime(stamp)
+
+    compile_command = CompileCommand()
+    compile_command._name = None
+    compile_command.output = rule.target
+    compile_command._extra_outputs = [stamp]
+    return compile_command
+
 def link_static(rule:Rule) -> CompileCommand:
+    '''
+        Archive objects. If archive already exists, only changed objects are replaced.
+        If no object changed, but other prerequisite (library of subproject) is newer,
+        archive is touched, so dependents are linked again. Otherwise archive is left untouched
+    '''
     cfg : Config = rule.parent.private_config
 
     dirn = os.path.dirname(rule.target)
     if dirn:
         os.makedirs(dirn,exist_ok=True)
 
+    objects = [x.target for x in rule.prerequisites if not x.phony and x.target.endswith('.o')]
+    flags = ''.join(cfg.AR_FLAGS) + ('T' if cfg.AR_THIN else '')
+
+    abs_dir_obj=os.path.join(cfg.CWD, cfg.OBJ_PATH)
+    members_path = os.path.join(abs_dir_obj, f'{os.path.basename(rule.target)}.members')
+    members = load_json(members_path)
+
+    # Archive members are replaced by file name, so names must be unique (except thin archives)
+    incremental = members is not None \
+        and os.path.exists(rule.target) \
+        and members['thin'] == cfg.AR_THIN \
+        and set(members['objects']) <= set(objects) \
+        and (cfg.AR_THIN or len(set(os.path.basename(x) for x in objects)) == len(objects))
+
+    if incremental:
+        archive_date = os.path.getmtime(rule.target)
+        objects_to_add = [x for x in objects if x not in members['objects'] or os.path.getmtime(x) > archive_date]
+        if not objects_to_add:
+            if any(not x.phony and os.path.getmtime(x.target) > archive_date for x in rule.prerequisites):
+                os.utime(rule.target)
+            return None
+    else:
+        silentremove(temp_output_path(rule.target))
+        objects_to_add = objects
+
     compile_command = CompileCommand()
     compile_command._name = color_text(33,'Linking static')
     compile_command.directory = cfg.CWD
     compile_command.output = rule.target
 
     compile_command.arguments = [cfg.AR] \
-    + [''.join(cfg.AR_FLAGS)] \
+    + [flags] \
     + [rule.target] \
-    + [x.target for x in rule.prerequisites if not x.phony and x.target.endswith('.o')]
+    + objects_to_add
 
-    abs_dir_obj=os.path.join(cfg.CWD, cfg.OBJ_PATH)
-    if not os.path.exists(abs_dir_obj):
+    # Existing archive is updated in place
+    compile_command._atomic = not incremental
+    compile_command._cacheable = not incremental
+
+    def _save_members():
         os.makedirs(abs_dir_obj,exist_ok=True)
-    with open(os.path.join(abs_dir_obj,'config_tag'),'w+') as f:
-        f.write(cfg.get_build_string())
+        save_json(members_path, {'thin':cfg.AR_THIN, 'objects':objects})
+    compile_command._post_exec = _save_members
 
     return compile_command
 
+_file_rules_lock = threading.Lock()
+
 def add_rules_from_d_file(path:str,project:ProjectBase):
     if not os.path.isabs(path):
         path = os.path.join(caller_cwd(),path)
     if not os.path.isfile(path):
         return
 
-    with open(path,'r') as f:
+    for target, prerequisites in parse_d_file(path):
+        rule = project.get_rule(_abs_target(target,project)) or project.find_rule(target)
+        if not rule:
+            rule = Rule(target,project)
+
+        for prq in prerequisites:
+            rule.prerequisites.append(_get_file_rule(_abs_target(prq,project),project))
+
+def _get_file_rule(path:str,project:ProjectBase) -> Rule:
+    '''
+        Rule of project by absolute path, rule shared with projects configured together or new one
+    '''
+    rule = project.get_rule(path)
+    if not rule:
+        # Rules of files met in '.d' files (headers): path -> rule
+        file_rules = configuration_cache('c.file_rules')
+        with _file_rules_lock:
+            rule = file_rules.get(path)
+            if not rule:
+                rule = Rule(path,project)
+                file_rules[path] = rule
+        project.rules.append(rule)
+    return rule
+
+_INCLUDE_RE = re.compile(rb'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"\n]+)[>"]', re.MULTILINE)
+
+def _scan_includes(path:str, cache:dict[str,list[tuple[bool,str]]]) -> tuple[str,list[tuple[bool,str]]]:
+    with open(path,'rb') as f:
         content = f.read()
 
-    # make list[str] = ["/dir/targtet:src1.c src2.c src3.c", ...]
-    content = content.replace('\\\n','')
-    content = content.replace('\n\n','\n')
-    content = content.split('\n')
+    digest = hashlib.sha1(content).hexdigest()
+    includes = cache.get(digest)
+    if includes is None:
+        includes = [(x.group(1) == b'"', x.group(2).decode(errors='replace').strip()) for x in _INCLUDE_RE.finditer(content)]
+        cache[digest] = includes
+    return digest, includes
 
-    for line in content:
-        if not line:
-            continue
-        spl = line.split(':')
-        if len(spl) < 2:
+def scan_includes(path:str) -> list[tuple[bool,str]]:
+    '''
+        Get `#include` directives of file: list of (is quoted, name).
+        Result is cached by file content hash while projects are configured
+    '''
+    return _scan_includes(path, configuration_cache('c.includes'))[1]
+
+def add_rules_from_includes(project:ProjectBase):
+    '''
+        Make sources depend on headers found by `#include` directives,
+        so header graph is known before the first compilation.
+        Includes are resolved against directory of file and INCLUDE_DIRS,
+        not found headers (system) are skipped unless there is rule to generate them.
+        '.d' files of compiler refine this graph later
+    '''
+    cfg : Config = project.private_config
+    include_dirs = cfg.get_abs_val(cfg.INCLUDE_DIRS)
+
+    # Include directives: content hash -> [(is quoted, name)], shared by projects configured together.
+    # File of project keeps only files of its last scan
+    includes_cache = configuration_cache('c.includes')
+    cache_path = project.data_path('includes.json')
+    stored = load_json(cache_path, {})
+    for k, v in stored.items():
+        includes_cache.setdefault(k, [tuple(x) for x in v])
+    seen : dict[str,list[tuple[bool,str]]] = {}
+
+    direct : dict[str,list[str]] = {}
+
+    def _direct_includes(path:str) -> list[str]:
+        if path not in direct:
+            result = []
+            if os.path.isfile(path):
+                digest, includes = _scan_includes(path, includes_cache)
+                seen[digest] = includes
+                for quoted, name in includes:
+                    dirs = [os.path.dirname(path)] + include_dirs if quoted else include_dirs
+                    for d in dirs:
+                        header = os.path.normpath(os.path.join(d, name))
+                        if os.path.isfile(header) or project.get_rule(header):
+                            result.append(header)
+                            break
+            direct[path] = result
+        return direct[path]
+
+    for source in cfg.SOURCES:
+        src_rule = project.get_rule(source)
+        if not src_rule:
             continue
 
-        target = spl[0].strip()
-        spl[1] = re.split(r'\s+',spl[1].strip()) if spl[1] else []
-        prerequisites = [x for x in spl[1] if x != target]
-        rule = project.find_rule(target)
-        if not rule:
-            rule = Rule(target,project)
+        known = set(x.target for x in src_rule.prerequisites)
+        queue = collections.deque(_direct_includes(source))
+        while queue:
+            header = queue.popleft()
+            if header in known:
+                continue
+            known.add(header)
+            src_rule.prerequisites.append(_get_file_rule(header,project))
+            queue.extend(_direct_includes(header))
 
-        for prq in prerequisites:
-            prq_rule = project.find_rule(prq)
-            if not prq_rule:
-                prq_rule = Rule(prq,project)
-                project.rules.append(prq_rule)
-            rule.prerequisites.append(prq_rule)
+    if seen.keys() != stored.keys():
+        save_json(cache_path, seen)
+
+def _abs_target(path:str,project:ProjectBase) -> str:
+    return path if os.path.isabs(path) else f'{project.private_config.CWD}/{path}'
 
 def gen_vscode_config(rule:Rule):
     '''
@@ -347,27 +673,81 @@ def gen_vscode_config(rule:Rule):
         json.dump(tasks, ftasks, indent=4)
 
 def clean(rule:Rule):
-    def _clean(_prj : Project):
-        silentremove(_prj.private_config.OBJ_PATH)
+    '''
+        Remove outputs of project and subprojects recorded by builds.
+        Projects built before outputs recording: remove objects directory and main target
+    '''
+    def _clean(_prj : ProjectBase):
+        if type(_prj) is Project and not os.path.exists(_prj.data_path('outputs.json')):
+            silentremove(_prj.private_config.get_abs_val(_prj.private_config.OBJ_PATH))
+            if _prj.main_rule:
+                silentremove(_prj.main_rule.target)
+        return 0
 
     rule.parent.project_recursive_run(_clean)
+    rule.parent.clean()
 
 def pkg_config_search(packages:list[str],config:Config):
     '''
         Load libs data from pkg-config
     '''
 
-    out = sh(["pkg-config","--cflags","--libs"]+packages,True)
-    if out.stderr:
-        logger.error(f'pkg_config_search :{out.stderr}')
+    code, out, err = probe_tool(["pkg-config","--cflags","--libs"]+packages, PKG_CONFIG_ENV, files=pkg_config_files(packages))
+    if code != 0:
+        logger.error(f'pkg_config_search :{err}')
         return
-    out = out.stdout.replace('\n','')
-    spl = out.split(' ')
+    spl = out.split()
 
     config.INCLUDE_DIRS.extend([x[2:] for x in spl if x.startswith('-I')])
     config.LIB_DIRS.extend([x[2:] for x in spl if x.startswith('-L')])
     config.LIBS.extend([x[2:] for x in spl if x.startswith('-l')])
 
+def pkg_config_files(packages:list[str]) -> list[str]:
+    '''
+        Directories where pkg-config looks for '.pc' files and '.pc' files of packages in them.
+        Installed, removed or upgraded packages change their modification times
+    '''
+    dirs = [x for x in os.environ.get('PKG_CONFIG_PATH','').split(os.pathsep) if x]
+    libdir = os.environ.get('PKG_CONFIG_LIBDIR')
+    if libdir is not None:
+        dirs += [x for x in libdir.split(os.pathsep) if x]
+    else:
+        code, out, err = probe_tool(['pkg-config','--variable','pc_path','pkg-config'], PKG_CONFIG_ENV)
+        if code == 0:
+            dirs += [x for x in out.strip().split(os.pathsep) if x]
+    return dirs + [os.path.join(d, f'{p}.pc') for d in dirs for p in packages]
+
+PKG_CONFIG_ENV = ['PKG_CONFIG_PATH','PKG_CONFIG_LIBDIR','PKG_CONFIG_SYSROOT_DIR','PKG_CONFIG_SYSTEM_INCLUDE_PATH','PKG_CONFIG_SYSTEM_LIBRARY_PATH']
+'''
+    Environment variables that influence on pkg-config output
+'''
+
+COMPILER_ENV = ['CPATH','C_INCLUDE_PATH','CPLUS_INCLUDE_PATH','LIBRARY_PATH','COMPILER_PATH','GCC_EXEC_PREFIX']
+'''
+    Environment variables that influence on compiler
+'''
+
+def get_compiler_info(compiler:str) -> dict:
+    '''
+        Compiler identity: {'version' : first line of `--version`}
+        Result is cached, see `probe_tool`
+    '''
+    code, out, err = probe_tool([compiler, '--version'], COMPILER_ENV)
+    version = out.splitlines()[0] if code == 0 and out else ''
+    return {'version':version}
+
+def find_sources(dirs:list[str], cwd:str) -> list[str]:
+    '''
+        Search C/C++ sources.
+        Result is cached while projects are configured together, so several projects (e.g. variants)
+        on the same sources scan them once. See `configuration_cache`
+    '''
+    # Found sources: (cwd, directories...) -> files
+    sources = configuration_cache('c.sources')
+    key = (cwd, *dirs)
+    if key not in sources:
+        sources[key] = find_files(dirs, ['.c','.cc','.cpp'], cwd=cwd)
+    return list(sources[key])
 
 def add_default_rules(project:ProjectBase) -> None:
     '''
@@ -379,10 +759,11 @@ def add_default_rules(project:ProjectBase) -> None:
     target_path = cfg.parent.target if os.path.isabs(cfg.parent.target) else os.path.join(cfg.CWD,cfg.parent.target)
 
     # Sources
-    cfg.SOURCES = cfg.get_abs_val(cfg.SOURCES) + find_files(cfg.SRC_DIRS, ['.c','.cc','.cpp'], cwd=cfg.CWD)
+    cfg.SOURCES = cfg.get_abs_val(cfg.SOURCES) + find_sources(cfg.SRC_DIRS, cfg.CWD)
     cfg.SOURCES = unify_list(cfg.SOURCES)
 
-    objects = [os.path.join(cfg.CWD,'obj',os.path.relpath(os.path.splitext(x)[0],cfg.CWD).replace('../','updir/'))+'.o' for x in cfg.SOURCES]
+    obj_path = cfg.get_abs_val(cfg.OBJ_PATH)
+    objects = [os.path.join(obj_path,os.path.relpath(os.path.splitext(x)[0],cfg.CWD).replace('../','updir/'))+'.o' for x in cfg.SOURCES]
 
     # Dependencies files '.d' paths
     deps = [f'{os.path.splitext(x)[0]}.d' for x in objects]
@@ -390,6 +771,10 @@ def add_default_rules(project:ProjectBase) -> None:
     ext = os.path.splitext(target_path)[1]
     object_rules = []
 
+    # Objects of shared library must be position independent
+    if ext == '.so' and '-fPIC' not in cfg.CFLAGS:
+        cfg.CFLAGS.append('-fPIC')
+
     for i in range(len(cfg.SOURCES)):
         # Create rules for sources/objects
         src_rule = Rule(cfg.SOURCES[i], cfg.parent)
@@ -412,18 +797,34 @@ def add_default_rules(project:ProjectBase) -> None:
             pub_cfg.LIBS.append(os.path.basename(target_path)[3:-2])
             pub_cfg.LIB_DIRS.append(os.path.dirname(target_path))
 
-        case '.so','.dll':
-            raise NotImplementedError('The shared library rules maker not implemented yet')
+        case '.so'|'.dll':
+            if not project.public_config:
+                project.public_config = cfg
+            project.main_rule = Rule(target_path, cfg.parent, object_rules, link_shared, False, LINK_POOL)
+            project.rules.append(project.main_rule)
+
+            # Dependents are linked again only if exported symbols changed
+            interface_path = os.path.join(obj_path, f'{os.path.basename(target_path)}.ifs')
+            project.interface_rule = Rule(interface_path, cfg.parent, [project.main_rule], update_interface, False)
+            project.rules.append(project.interface_rule)
+
+            pub_cfg : Config = project.public_config
+            pub_cfg.LIBS.append(os.path.splitext(os.path.basename(target_path))[0].removeprefix('lib'))
+            pub_cfg.LIB_DIRS.append(os.path.dirname(target_path))
+            pub_cfg.RPATH_DIRS.append(os.path.dirname(target_path))
 
         case '.elf'|'.exe'|'':
-            project.main_rule = Rule(target_path, cfg.parent, object_rules, link_executable, False)
+            project.main_rule = Rule(target_path, cfg.parent, object_rules, link_executable, False, LINK_POOL)
             project.rules.append(project.main_rule)
 
     for sp in project.subprojects:
         sp.public_config.make_abs()
-        project.main_rule.prerequisites.append(sp.main_rule)
+        project.main_rule.prerequisites.append(getattr(sp, 'interface_rule', None) or sp.main_rule)
         project.private_config.extend(sp.public_config)
 
+    if cfg.SCAN_INCLUDES:
+        add_rules_from_includes(project)
+
     rule_build = Rule('build',project,[project.main_rule],phony=True)
     rule_clean = Rule('clean',project,exec=clean,phony=True)
 
@@ -1,19 +1,87 @@
 from mapyr.core import *
 
+import sys
+
+WORKER_PATH = os.path.join(os.path.dirname(__file__), 'pyworker.py')
+'''
+    Script what runs generator script in separate process
+'''
+
+def _depfile_path(rule:Rule) -> str:
+    '''
+        File of inputs recorded at last run of the rule script, make format
+    '''
+    return rule.parent.data_path('python', f'{os.path.relpath(rule.target, rule.parent.private_config.CWD)}.d')
+
 def run(rule:Rule) -> CompileCommand:
+    '''
+        Run `run(rule)` function of script (first prerequisite) in separate process.
+        `rule` of the script has `target`, `prerequisites` (list of objects with `target`) and `cwd`.
+        Imported modules and files read by script are recorded, see `add_script`
+    '''
+    script_path = rule.prerequisites[0].target
+
+    if not os.path.isabs(script_path):
+        script_path = os.path.join(rule.parent.private_config.CWD, script_path)
+
+    path = os.path.dirname(rule.target)
+    if path and not os.path.exists(path):
+        os.makedirs(path,exist_ok=True)
+
+    compile_command = CompileCommand()
+    compile_command._name = utils.color_text(35,'Script running')
+    compile_command.directory = rule.parent.private_config.CWD
+    compile_command.output = rule.target
+
+    # Script chooses where to write
+    compile_command._atomic = False
+    compile_command._depfile = _depfile_path(rule)
+    compile_command._identity = sys.version
+
+    compile_command.arguments = [sys.executable, WORKER_PATH, script_path, compile_command._depfile, rule.target] \
+    + [x.target for x in rule.prerequisites[1:]]
+
+    return compile_command
+
+def run_in_process(rule:Rule) -> CompileCommand:
+    '''
+        Run `run(rule)` function of script (first prerequisite) in build process
+    '''
     target_path = rule.prerequisites[0].target
 
     compile_command = CompileCommand()
     compile_command._name = utils.color_text(35,'Script running')
-    compile_command.output = target_path
+    compile_command.output = rule.target
 
     if not os.path.isabs(target_path):
         target_path = os.path.join(rule.parent.private_config.CWD, target_path)
 
-    path = os.path.dirname(target_path)
-    if not os.path.exists(path):
+    path = os.path.dirname(rule.target)
+    if path and not os.path.exists(path):
         os.makedirs(path,exist_ok=True)
 
     utils.get_module(target_path).run(rule)
 
     return compile_command
+
+def add_script(rule:Rule, script:str) -> None:
+    '''
+        Make `rule` generated by script. Inputs recorded at previous run of the script
+        (imported modules, read files) become prerequisites of the rule
+    '''
+    project = rule.parent
+    script_rule = Rule(script, project)
+    project.rules.append(script_rule)
+    rule.prerequisites.append(script_rule)
+    rule.exec = run
+
+    depfile = _depfile_path(rule)
+    recorded = [x for _, prerequisites in utils.parse_d_file(depfile) for x in prerequisites] if os.path.isfile(depfile) else []
+    for path in recorded:
+        if path == script_rule.target or path == rule.target:
+            continue
+        prq = project.get_rule(path)
+        if not prq:
+            prq = Rule(path, project)
+            project.rules.append(prq)
+        rule.prerequisites.append(prq)
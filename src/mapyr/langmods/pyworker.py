@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# Run generator script and record its inputs
+# Usage: pyworker.py <script> <depfile> <target> [prerequisites...]
+
+import os
+import sys
+
+# Scripts may import mapyr, use the same mapyr as the build
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import importlib.util
+import types
+
+def _is_tool_file(path:str) -> bool:
+    '''
+        Files of python installation and mapyr itself are not inputs of script
+    '''
+    prefixes = {sys.prefix, sys.base_prefix, sys.exec_prefix, os.path.dirname(os.path.dirname(__file__))}
+    return any(path.startswith(f'{x}{os.sep}') for x in prefixes) or '__pycache__' in path
+
+def main(script:str, depfile:str, target:str, prerequisites:list[str]) -> int:
+    read_files = set()
+
+    def _audit(event, args):
+        if event != 'open' or not isinstance(args[0], str):
+            return
+        path, mode, flags = args
+        if mode is None:
+            if flags & (os.O_WRONLY | os.O_RDWR):
+                return
+        elif any(x in mode for x in 'wax+'):
+            return
+        read_files.add(os.path.abspath(path))
+
+    sys.path.insert(0, os.path.dirname(script))
+    spec = importlib.util.spec_from_file_location('__mapyr_script__', script)
+    if spec is None:
+        raise ModuleNotFoundError(script)
+    module = importlib.util.module_from_spec(spec)
+
+    sys.addaudithook(_audit)
+    spec.loader.exec_module(module)
+
+    rule = types.SimpleNamespace(
+        target = target,
+        prerequisites = [types.SimpleNamespace(target=x) for x in [script] + prerequisites],
+        cwd = os.getcwd(),
+    )
+    result = module.run(rule)
+
+    modules = [getattr(x, '__file__', None) for x in list(sys.modules.values())]
+    inputs = set(os.path.abspath(x) for x in modules if x) | read_files
+    inputs = sorted(x for x in inputs if x != target and os.path.isfile(x) and not _is_tool_file(x))
+
+    # Make format, like compilers do
+    os.makedirs(os.path.dirname(depfile), exist_ok=True)
+    with open(depfile, 'w') as f:
+        f.write(f'{target}:' + ''.join(f' \\\n {x}' for x in inputs) + '\n')
+
+    return result if type(result) is int else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4:]))
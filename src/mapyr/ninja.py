@@ -0,0 +1,213 @@
+from .core import *
+from . import core
+from .langmods import c
+from .langmods import python
+
+import re
+import shlex
+
+COMMAND_EXECS : dict = {
+    c.build_object: 'cc',
+    c.link_executable: 'link',
+    c.link_shared: 'link',
+    python.run: 'cmd',
+}
+'''
+    Exec functions without side effects, they only make command: function -> ninja rule name.
+    Commands of these functions are written to build file as is,
+    rules with other exec functions are built by mapyr invocation
+'''
+
+_ANSI_RE = re.compile(r'\x1b\[[0-9;]*m')
+
+def escape_path(path:str) -> str:
+    return path.replace('$','$$').replace(' ','$ ').replace(':','$:')
+
+def escape(value:str) -> str:
+    return value.replace('$','$$')
+
+def _is_tool_file(path:str) -> bool:
+    prefixes = {sys.prefix, sys.base_prefix, sys.exec_prefix, os.path.dirname(__file__)}
+    return any(path.startswith(f'{x}{os.sep}') for x in prefixes)
+
+def get_build_scripts() -> list[str]:
+    '''
+        Loaded python files outside python installation and mapyr: build scripts and their helpers
+    '''
+    result = []
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if path and os.path.isfile(path):
+            path = os.path.abspath(path)
+            if not _is_tool_file(path):
+                result.append(path)
+    return sorted(set(result))
+
+def _link_static_arguments(rule:Rule) -> list[str]:
+    '''
+        Full (not incremental) archiving command
+    '''
+    cfg : c.Config = rule.parent.private_config
+    flags = ''.join(cfg.AR_FLAGS) + ('T' if cfg.AR_THIN else '')
+    return [cfg.AR, flags, rule.target] + [x.target for x in rule.prerequisites if not x.phony and x.target.endswith('.o')]
+
+def export(projects:list[ProjectBase], path:str = 'build.ninja', project_names:list[str] = None, script:str = None) -> None:
+    '''
+        Write rules of projects and their subprojects as ninja build file.
+
+        project_names : names of projects for `get_project`, used by mapyr invocations
+        script : build script, by default caller script
+    '''
+    path = os.path.abspath(path)
+    build_dir = os.path.dirname(path)
+    script = os.path.abspath(script or utils.caller_file())
+    project_names = project_names or ['main']
+    mapyr_cmd = f'{shlex.quote(sys.executable)} {shlex.quote(script)} -p {shlex.quote(",".join(project_names))}'
+
+    def _path(target:str) -> str:
+        return escape_path(os.path.relpath(target, build_dir))
+
+    def _name(rule:Rule) -> str:
+        return escape_path(rule.target) if rule.phony else _path(rule.target)
+
+    lines = [
+        f'# Generated by mapyr {VERSION} from {os.path.relpath(script, build_dir)}, do not edit',
+        'ninja_required_version = 1.5',
+        '',
+    ]
+
+    # Module CONFIG is replaced by `process`, read actual one
+    pools = core.CONFIG.POOLS
+    for pool, depth in pools.items():
+        lines += [f'pool {pool}', f'  depth = {depth}', '']
+
+    lines += [
+        'rule cc',
+        '  command = cd $dir && $cmd',
+        '  description = $desc',
+        '  depfile = $depfile',
+        '',
+        'rule link',
+        '  command = cd $dir && $cmd',
+        '  description = $desc',
+        '',
+        'rule ar',
+        '  command = cd $dir && $cmd',
+        '  description = $desc',
+        '',
+        'rule cmd',
+        '  command = cd $dir && $cmd',
+        '  description = $desc',
+        '',
+        'rule mapyr',
+        f'  command = {escape(mapyr_cmd)} $target',
+        '  description = mapyr $target',
+        '  restat = 1',
+        '',
+        'rule clean',
+        '  command = ninja -f $in -t clean',
+        '  description = Cleaning',
+        '',
+        'rule regen',
+        f'  command = {escape(mapyr_cmd)} ninja $out',
+        '  description = Regenerating $out',
+        '  generator = 1',
+        '',
+    ]
+
+    # All rules reachable from projects
+    rules : dict = {}
+    stack = []
+    for project in projects:
+        for p in project.get_projects():
+            stack.extend(p.rules)
+            if p.main_rule:
+                stack.append(p.main_rule)
+    while stack:
+        rule = stack.pop()
+        key = (rule.parent, rule.target) if rule.phony else rule.target
+        if key in rules:
+            continue
+        rules[key] = rule
+        if rule.prerequisites:
+            stack.extend(rule.prerequisites)
+
+    phony_names = set()
+    for rule in rules.values():
+        prerequisites = [x for x in rule.prerequisites] if rule.prerequisites else []
+
+        if rule.phony:
+            # Phony rules with the same name in several projects are merged
+            if rule.target in phony_names or rule.target in ('build', 'clean'):
+                continue
+            phony_names.add(rule.target)
+            same = [x for x in rules.values() if x.phony and x.target == rule.target]
+            if any(x.exec for x in same):
+                lines += [f'build {_name(rule)}: mapyr', f'  target = {escape(shlex.quote(rule.target))}', '']
+            else:
+                inputs = [_name(x) for r in same for x in (r.prerequisites or [])]
+                lines += [f'build {_name(rule)}: phony {" ".join(inputs)}', '']
+            continue
+
+        if not rule.exec:
+            continue
+
+        inputs = ' '.join(_name(x) for x in prerequisites)
+        ninja_rule = COMMAND_EXECS.get(rule.exec)
+        if rule.exec is c.link_static:
+            ninja_rule = 'ar'
+            arguments = _link_static_arguments(rule)
+            desc = f'Linking static: {os.path.relpath(rule.target)}'
+            directory = rule.parent.private_config.CWD
+        elif ninja_rule:
+            compile_command : CompileCommand = rule.exec(rule)
+            arguments = compile_command.arguments or shlex.split(compile_command.command)
+            desc = f'{_ANSI_RE.sub("", compile_command._name)}: {os.path.relpath(rule.target)}'
+            directory = compile_command.directory or rule.parent.private_config.CWD
+        else:
+            lines += [f'build {_name(rule)}: mapyr {inputs}', f'  target = {escape(shlex.quote(rule.target))}']
+            if rule.pool in pools:
+                lines.append(f'  pool = {rule.pool}')
+            lines.append('')
+            continue
+
+        if ninja_rule == 'cc':
+            # Ninja requires object as depfile target, named as output of the edge.
+            # Depfiles are left in place (no 'deps = gcc'), so mapyr can still use them
+            arguments = list(arguments)
+            arguments[arguments.index('-MT') + 1] = os.path.relpath(rule.target, build_dir)
+            depfile = os.path.relpath(arguments[arguments.index('-MF') + 1], build_dir)
+
+        cmd = shlex.join(arguments)
+        if ninja_rule == 'ar':
+            # Archive is made from scratch, members of removed objects must not stay
+            cmd = f'rm -f {shlex.quote(rule.target)} && {cmd}'
+
+        lines += [
+            f'build {_name(rule)}: {ninja_rule} {inputs}',
+            f'  dir = {escape(shlex.quote(directory))}',
+            f'  cmd = {escape(cmd)}',
+            f'  desc = {escape(desc)}',
+        ]
+        if ninja_rule == 'cc':
+            lines.append(f'  depfile = {escape(depfile)}')
+        if rule.pool in pools:
+            lines.append(f'  pool = {rule.pool}')
+        lines.append('')
+
+    main_rules = [p.main_rule for p in projects if p.main_rule]
+    lines += [
+        f'build build: phony {" ".join(_name(x) for x in main_rules)}',
+        '',
+        f'build clean: clean {escape_path(os.path.basename(path))}',
+        '',
+        f'build {escape_path(os.path.basename(path))}: regen {" ".join(_path(x) for x in get_build_scripts())}',
+        '',
+        'default build',
+        '',
+    ]
+
+    os.makedirs(build_dir, exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+    logger.info(f'Ninja build file: {path}')
@@ -5,6 +5,10 @@ import shutil
 import importlib
 import inspect
 import hashlib
+import json
+import threading
+import signal
+import re
 from mapyr.logs import logger
 
 
@@ -51,9 +55,41 @@ class CompletedProcess:
         self.returncode = exitstatus
         self.output = output
 
+_children = set()
+_children_lock = threading.Lock()
+_children_terminated = threading.Event()
+
+def _kill_child(child:pexpect.spawn) -> None:
+    '''
+        Kill process group of child: pexpect makes child a session leader,
+        so its own children (cc1, as, ld of compiler driver, commands of shell) are killed too
+    '''
+    try:
+        os.killpg(child.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def terminate_children():
+    '''
+        Kill all child processes started by `sh` and don't allow to start new ones
+    '''
+    with _children_lock:
+        _children_terminated.set()
+        for child in _children:
+            _kill_child(child)
+
+def allow_children():
+    '''
+        Allow `sh` to start child processes again after `terminate_children`
+    '''
+    _children_terminated.clear()
+
 def sh(cmd: str | list[str], shell=False, cwd=None) -> CompletedProcess:
     logger.debug(cmd)
 
+    if _children_terminated.is_set():
+        return CompletedProcess(cmd,-signal.SIGTERM,'')
+
     program : str = cmd
     args : list[str] = []
     if type(cmd) is list:
@@ -67,11 +103,20 @@ def sh(cmd: str | list[str], shell=False, cwd=None) -> CompletedProcess:
        args = []
 
     child = pexpect.spawn(program,args,encoding='UTF-8',codec_errors='replace', cwd=cwd)
-    output = child.read()
-    child.close(force=False)
+    with _children_lock:
+        _children.add(child)
+        if _children_terminated.is_set():
+            _kill_child(child)
+    try:
+        output = child.read()
+        child.close(force=False)
+    finally:
+        with _children_lock:
+            _children.discard(child)
     logger.debug(output)
     print(output,end="")
-    return CompletedProcess(cmd,child.exitstatus,output)
+    returncode = child.exitstatus if child.exitstatus is not None else -(child.signalstatus or 1)
+    return CompletedProcess(cmd,returncode,output)
 
 def silentremove(filename:str):
     '''
@@ -84,6 +129,26 @@ def silentremove(filename:str):
     except IsADirectoryError:
         shutil.rmtree(filename,ignore_errors=True)
 
+def load_json(path:str, default=None):
+    '''
+        Load json file or return `default` if it doesn't exist or broken
+    '''
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def save_json(path:str, data):
+    '''
+        Save json file atomically
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w+') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
 def get_size(path:str) -> int:
     '''
         Get file size in bytes
@@ -128,17 +193,61 @@ def get_module(path:str):
     spec.loader.exec_module(foo)
     return foo
 
-def caller_cwd() -> str:
+def caller_file() -> str:
     '''
-        Path to caller script directory
+        Path to caller script, first file in stack outside mapyr
     '''
     for frame in inspect.stack():
         path = frame[1]
         if not path.startswith(os.path.dirname(__file__)):
-            return os.path.dirname(os.path.abspath(path))
+            return os.path.abspath(path)
     raise RuntimeError('frame not found')
 
+def caller_cwd() -> str:
+    '''
+        Path to caller script directory
+    '''
+    return os.path.dirname(caller_file())
+
 def stable_hash(value:str) -> int:
     hasher = hashlib.sha256()
     hasher.update(value.encode('utf-8'))
     return int.from_bytes(hasher.digest(), byteorder='big')
+
+_d_files_cache : dict[str,tuple[float,list[tuple[str,list[str]]]]] = {}
+'''
+    Parsed '.d' files: path -> (modification time, [(target, prerequisites)])
+'''
+
+def parse_d_file(path:str) -> list[tuple[str,list[str]]]:
+    '''
+        Parse '.d' file into list of (target, prerequisites).
+        Result is cached until file modification
+    '''
+    mtime = os.path.getmtime(path)
+    cached = _d_files_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path,'r') as f:
+        content = f.read()
+
+    # make list[str] = ["/dir/targtet:src1.c src2.c src3.c", ...]
+    content = content.replace('\\\n','')
+    content = content.replace('\n\n','\n')
+    content = content.split('\n')
+
+    result = []
+    for line in content:
+        if not line:
+            continue
+        spl = line.split(':')
+        if len(spl) < 2:
+            continue
+
+        target = spl[0].strip()
+        spl[1] = re.split(r'\s+',spl[1].strip()) if spl[1] else []
+        result.append((target, [x for x in spl[1] if x != target]))
+
+    _d_files_cache[path] = (mtime, result)
+    return result
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# Memory and time of rules construction on generated graph
+# Usage: ./bench_rules.py [nodes number]
+
+# Import local mapyr, not global
+import os
+import sys
+sys.path.insert(0,f"{os.path.dirname(__file__)}/../src")
+
+import time
+import tracemalloc
+from mapyr import *
+
+class BenchConfig(ConfigBase):
+    def extend(self, other, members = None):
+        pass
+
+def make_graph(nodes:int) -> ProjectBase:
+    '''
+        C-like graph: headers, sources and objects that depend on source and several headers
+    '''
+    project = ProjectBase('bench','bin/main',BenchConfig())
+
+    headers_num = nodes // 10
+    units_num = (nodes - headers_num) // 2
+
+    headers = []
+    for i in range(headers_num):
+        headers.append(Rule(f'include/dir{i % 100}/header{i}.h', project))
+
+    objects = []
+    for i in range(units_num):
+        src = Rule(f'src/dir{i % 100}/source{i}.c', project)
+        obj = Rule(f'obj/src/dir{i % 100}/source{i}.o', project, [src] + [headers[(i * 7 + k) % headers_num] for k in range(5)])
+        project.rules.append(src)
+        project.rules.append(obj)
+        objects.append(obj)
+
+    project.rules.extend(headers)
+    project.main_rule = Rule('bin/main', project, objects)
+    project.rules.append(project.main_rule)
+    return project
+
+if __name__ == "__main__":
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    # Time and memory are measured separately, tracing slows construction down
+    start = time.perf_counter()
+    project = make_graph(nodes)
+    elapsed = time.perf_counter() - start
+    del project
+
+    tracemalloc.start()
+    project = make_graph(nodes)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rules_num = len(project.rules)
+    print(f'Rules:          {rules_num}')
+    print(f'Construction:   {elapsed:.3f} s')
+    print(f'Memory:         {memory / 2**20:.1f} MiB')
+    print(f'Memory/rule:    {memory / rules_num:.0f} bytes')
@@ -32,16 +32,14 @@ def get_project(name:str) -> 'c.Project':
     config.VSCODE_CPPTOOLS_CONFIG = True
 
     # Create project and make default rules
-    project = c.Project('release','bin/main',config,subprojects=[lib.lib1.build.get_project()])
+    # Subprojects given by functions are constructed concurrently
+    project = c.Project('release','bin/main',config,subprojects=[lib.lib1.build.get_project])
     c.add_default_rules(project)
 
-    # Add dependency of the script_artefact.c on python script
-    script = Rule('script.py',project)
+    # Make script_artefact.c generated by python script,
+    # modules and files used by the script are tracked too
     src_rule = project.find_rule('script_artefact.c')
-    src_rule.prerequisites.append(script)
-
-    # Add method what we have to run to make the target
-    src_rule.exec = python.run
+    python.add_script(src_rule,'script.py')
 
     return project
 
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+# Artifact cache with reference server on example project: build, clean and build again,
+# then build in another checkout. Outputs of rebuilds must be restored from cache
+# Usage: ./cache_check.py
+
+# Import local mapyr, not global
+import os
+import sys
+sys.path.insert(0,f"{os.path.dirname(__file__)}/../src")
+
+import re
+import shutil
+import tempfile
+import threading
+import subprocess
+from mapyr import cache
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(TESTS_DIR, '..', 'src'))
+
+def build(checkout:str, url:str, *args:str) -> int:
+    '''
+        Run build script of checkout with its mapyr and cache, returns number of restored commands
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.join(checkout, 'src')] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    result = subprocess.run([sys.executable, 'build.py', *args, '--cache', url], cwd=os.path.join(checkout, 'tests'), env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'Build failed in {checkout}:\n{result.stdout}{result.stderr}')
+    match = re.search(r'Restored from artifact cache: (\d+)', result.stderr)
+    return int(match.group(1)) if match else 0
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as temp:
+        server = cache.serve(os.path.join(temp, 'cache'), port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}'
+
+        try:
+            checkouts = []
+            for name in ['a', 'b']:
+                checkout = os.path.join(temp, name)
+                ignore = shutil.ignore_patterns('bin', 'obj', '.mapyr', '.vscode', '__pycache__', '*.log', 'bench_rules.py', 'cache_check.py')
+                shutil.copytree(TESTS_DIR, os.path.join(checkout, 'tests'), ignore=ignore)
+                shutil.copytree(SRC_DIR, os.path.join(checkout, 'src'), ignore=ignore)
+                checkouts.append(checkout)
+
+            build(checkouts[0], url)
+            build(checkouts[0], url, '-p', 'main', 'clean')
+            restored = build(checkouts[0], url)
+            assert restored > 0, 'Nothing restored after clean'
+
+            # Paths of checkout and its mapyr are not part of keys
+            other = build(checkouts[1], url)
+            assert other == restored, f'Restored in other checkout: {other} of {restored}'
+        finally:
+            server.shutdown()
+
+    print(f'Restored:       {restored}')
+    print(f'Other checkout: {other}')
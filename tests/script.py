@@ -3,7 +3,9 @@
 import mapyr
 import os
 
-def run(rule:mapyr.core.Rule) -> int:
-    with open(f'{os.path.dirname(__file__)}/src/script_artefact.c','w+') as f:
-        f.write('int some_fnc(){return 0;}')
-    return 0
\ No newline at end of file
+def run(rule) -> int:
+    with open(f'{os.path.dirname(__file__)}/script_data.txt','r') as f:
+        content = f.read()
+    with open(rule.target,'w+') as f:
+        f.write(content)
+    return 0